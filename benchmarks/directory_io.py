@@ -0,0 +1,96 @@
+"""
+Measures how DirectoryHandler behaves under a mix of hot and cold reads.
+
+Cold reads are simulated by sleeping in the file system code, as a stand-in
+for a slow disk or network file system. The benchmark reports latency
+percentiles for the hot requests, and the worst event loop stall seen by a
+ticker task, with and without the `io_threads` thread pool.
+
+    python benchmarks/directory_io.py
+"""
+
+import asyncio
+import os.path
+import time
+
+from argparse import ArgumentParser
+
+from gopher_server.handlers import DirectoryHandler, Request
+
+
+BASE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples/data/")
+
+
+class SlowDirectoryHandler(DirectoryHandler):
+    def __init__(self, *args, cold_delay: float, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cold_delay = cold_delay
+
+    def _handle(self, request):
+        if request.selector == "image.png":
+            time.sleep(self.cold_delay)
+        return super()._handle(request)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def ticker(stalls: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        stalls.append(time.perf_counter() - start - 0.001)
+
+
+async def client(handler, selector: str, count: int, latencies: list):
+    for _ in range(count):
+        start = time.perf_counter()
+        # Yield first so the latency includes waiting for the event loop.
+        await asyncio.sleep(0)
+        await handler.handle(Request("localhost", 7000, selector))
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(handler, hot_clients: int, cold_clients: int, requests: int):
+    latencies, stalls = [], []
+    stop = asyncio.Event()
+    ticker_task = asyncio.ensure_future(ticker(stalls, stop))
+    await asyncio.gather(
+        *(client(handler, "example", requests, latencies) for _ in range(hot_clients)),
+        *(client(handler, "image.png", requests // 10, []) for _ in range(cold_clients)),
+    )
+    stop.set()
+    await ticker_task
+    return latencies, stalls
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--hot-clients", type=int, default=20)
+    parser.add_argument("--cold-clients", type=int, default=2)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--cold-delay", type=float, default=0.02)
+    parser.add_argument("--io-threads", type=int, default=4)
+    parser.add_argument("--io-queue-size", type=int, default=64)
+    args = parser.parse_args()
+
+    for io_threads in (None, args.io_threads):
+        handler = SlowDirectoryHandler(
+            BASE_PATH, io_threads=io_threads, io_queue_size=args.io_queue_size,
+            cold_delay=args.cold_delay,
+        )
+        latencies, stalls = asyncio.run(run(
+            handler, args.hot_clients, args.cold_clients, args.requests,
+        ))
+        print("io_threads=%s: hot p50 %.2fms, p99 %.2fms, max loop stall %.2fms" % (
+            io_threads,
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000,
+            max(stalls) * 1000,
+        ))
+
+
+if __name__ == "__main__":
+    main()
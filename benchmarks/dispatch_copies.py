@@ -0,0 +1,64 @@
+"""
+Measures how much memory Application.dispatch allocates per response.
+
+A large text file is served through a handler which returns it as a string
+(decoded from the file, as DirectoryHandler used to), and through
+DirectoryHandler, which returns an EncodedResponse. Peak allocation divided by
+the response size gives roughly the number of full copies made of the
+response.
+
+    python benchmarks/dispatch_copies.py
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+import tracemalloc
+
+from argparse import ArgumentParser
+
+from gopher_server.application import Application
+from gopher_server.handlers import DirectoryHandler
+
+
+class DecodingHandler(DirectoryHandler):
+    async def handle(self, request):
+        with open(os.path.join(self.base_path, request.selector), "rb") as f:
+            return f.read().decode("utf-8")
+
+
+async def measure(application: Application, size: int, iterations: int):
+    tracemalloc.start()
+    await application.dispatch("localhost", 7000, b"file.txt\r\n")
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await application.dispatch("localhost", 7000, b"file.txt\r\n")
+    return peak / size, (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--size", type=int, default=10 * 1024 * 1024)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as base_path:
+        line = b"hello gopher world, this is a line of text\n"
+        with open(os.path.join(base_path, "file.txt"), "wb") as f:
+            f.write(line * (args.size // len(line)))
+
+        for name, handler in (
+            ("str response", DecodingHandler(base_path)),
+            # Larger files would be streamed rather than encoded in one go.
+            ("EncodedResponse", DirectoryHandler(base_path, stream_text_size=args.size + 1)),
+        ):
+            copies, seconds = asyncio.run(measure(Application(handler), args.size, args.iterations))
+            print("%-16s %5.1f copies %8.2f ms" % (name, copies, seconds * 1000))
+
+
+if __name__ == "__main__":
+    main()
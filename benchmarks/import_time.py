@@ -0,0 +1,81 @@
+"""
+Measures how long it takes to import each gopher_server module, using
+Python's `-X importtime` option.
+
+Each module is imported in a fresh interpreter several times, and the
+fastest run is reported along with the slowest imports it pulled in. Pass
+`--max-ms` to exit with an error if any module takes longer than that, so
+this can be used to catch import time regressions.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --max-ms 150
+"""
+
+import os.path
+import subprocess
+import sys
+
+from argparse import ArgumentParser
+
+
+MODULES = [
+    "gopher_server.application",
+    "gopher_server.handlers",
+    "gopher_server.listeners",
+    "gopher_server.pack",
+    "gopher_server.workers",
+]
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module: str) -> dict:
+    """Returns the cumulative import time of every module imported, in microseconds."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        check=True, capture_output=True, text=True,
+        env=dict(os.environ, PYTHONPATH=REPO_PATH),
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="number of slowest imports to show")
+    parser.add_argument("--max-ms", type=float, help="fail if any module takes longer than this")
+    args = parser.parse_args()
+
+    too_slow = []
+    for module in MODULES:
+        times = min(
+            (import_times(module) for _ in range(args.runs)), key=lambda times: times[module],
+        )
+        total_ms = times[module] / 1000
+        print("%-28s %7.1f ms" % (module, total_ms))
+        # Only show top level packages, as their submodules are included.
+        dependencies = sorted(
+            (
+                (name, time) for name, time in times.items()
+                if "." not in name and name != "gopher_server"
+            ),
+            key=lambda item: -item[1],
+        )
+        for name, time in dependencies[:args.top]:
+            print("    %-24s %7.1f ms" % (name, time / 1000))
+        if args.max_ms is not None and total_ms > args.max_ms:
+            too_slow.append(module)
+
+    if too_slow:
+        print("Over %s ms: %s" % (args.max_ms, ", ".join(too_slow)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Load tests the listeners, and records throughput, latency percentiles and
+server memory use as JSON so that results can be compared across commits.
+
+Each combination of listener and scenario is run against a server in a
+separate process, with a number of concurrent clients in this process making
+requests for a fixed amount of time. The scenarios are:
+
+* `small_text`: a 1 KiB text file from `DirectoryHandler`.
+* `large_binary`: a large binary file from `DirectoryHandler`.
+* `big_menu`: a generated menu for a directory with many files.
+* `pattern_route`: a dynamic route out of many registered with
+  `PatternHandler`.
+
+The TLS and QUIC listeners need a certificate and private key. These are
+generated with `openssl` if they aren't given, and the QUIC listener is
+skipped if `aioquic` isn't installed.
+
+    python benchmarks/load_test.py --output before.json
+    python benchmarks/load_test.py --output after.json --compare before.json
+"""
+
+import asyncio
+import json
+import multiprocessing
+import os.path
+import platform
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from datetime import datetime, timezone
+
+from gopher_server.application import Application
+from gopher_server.handlers import DirectoryHandler, PatternHandler
+from gopher_server.listeners import QUIC_ENABLED, quic_listener, tcp_listener, tcp_tls_listener
+
+if QUIC_ENABLED:
+    from aioquic.asyncio import connect
+    from aioquic.quic.configuration import QuicConfiguration
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+LISTENERS = ["tcp", "tls", "quic"]
+
+SCENARIOS = {
+    "small_text": "small.txt",
+    "large_binary": "large.bin",
+    "big_menu": "menu",
+    "pattern_route": "item/500/detail",
+}
+
+PATTERN_ROUTES = 1000
+
+
+def create_data(path: str, large_size: int, menu_entries: int):
+    with open(os.path.join(path, "small.txt"), "w") as f:
+        f.write(("hello world " * 5 + "\n") * 16)
+    with open(os.path.join(path, "large.bin"), "wb") as f:
+        f.write(os.urandom(large_size))
+    os.mkdir(os.path.join(path, "menu"))
+    for i in range(menu_entries):
+        with open(os.path.join(path, "menu", "file%06d.txt" % i), "w") as f:
+            f.write("entry %s\n" % i)
+
+
+def create_certificate(path: str):
+    certificate_path = os.path.join(path, "server.crt")
+    private_key_path = os.path.join(path, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+            "-nodes", "-days", "1", "-subj", "/CN=localhost",
+            "-keyout", private_key_path, "-out", certificate_path,
+        ],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return certificate_path, private_key_path
+
+
+def create_application(scenario: str, data_path: str) -> Application:
+    if scenario == "pattern_route":
+        handler = PatternHandler()
+        for i in range(PATTERN_ROUTES):
+            handler.register("item/%s/(?P<name>.+)" % i)(
+                lambda request, name: "%s of %s\n" % (name, request.selector)
+            )
+        return Application(handler)
+    return Application(DirectoryHandler(data_path, generate_menus=(scenario == "big_menu")))
+
+
+def serve(listener: str, scenario: str, data_path: str, certificate: tuple, port: int,
+          use_uvloop: bool, ready):
+    if use_uvloop:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    application = create_application(scenario, data_path)
+    if listener == "tcp":
+        coroutine = tcp_listener(application, "localhost", "127.0.0.1", port)
+    elif listener == "tls":
+        coroutine = tcp_tls_listener(application, "localhost", "127.0.0.1", port, *certificate)
+    else:
+        coroutine = quic_listener(application, "localhost", "127.0.0.1", port, *certificate)
+    loop.run_until_complete(coroutine)
+    ready.set()
+    loop.run_forever()
+
+
+def memory_kib(pid: int):
+    """Returns the current and peak RSS of a process, if /proc is available."""
+    values = {}
+    try:
+        with open("/proc/%s/status" % pid) as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    values[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return values.get("VmRSS"), values.get("VmHWM")
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.bytes = 0
+        self.errors = 0
+        self.recording = False
+
+    def record(self, start: float, response: bytes):
+        if not self.recording:
+            return
+        if response.startswith(b"3"):
+            self.errors += 1
+        self.latencies.append(time.perf_counter() - start)
+        self.bytes += len(response)
+
+
+async def stream_client(port: int, selector: bytes, ssl_context, stats: Stats, deadline: float):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        reader, writer = await asyncio.open_connection(
+            "127.0.0.1", port, ssl=ssl_context,
+            server_hostname="localhost" if ssl_context else None,
+        )
+        writer.write(selector)
+        response = await reader.read()
+        writer.close()
+        stats.record(start, response)
+
+
+async def quic_client(port: int, selector: bytes, stats: Stats, deadline: float):
+    configuration = QuicConfiguration(is_client=True, verify_mode=ssl.CERT_NONE)
+    async with connect("127.0.0.1", port, configuration=configuration) as connection:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            reader, writer = await connection.create_stream()
+            writer.write(selector)
+            writer.write_eof()
+            response = await reader.read()
+            stats.record(start, response)
+
+
+async def load(listener: str, port: int, selector: bytes, concurrency: int, warmup: float,
+               duration: float) -> Stats:
+    stats = Stats()
+    ssl_context = None
+    if listener == "tls":
+        ssl_context = ssl.create_default_context()
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+
+    deadline = time.perf_counter() + warmup + duration
+    if listener == "quic":
+        clients = [quic_client(port, selector, stats, deadline) for _ in range(concurrency)]
+    else:
+        clients = [
+            stream_client(port, selector, ssl_context, stats, deadline) for _ in range(concurrency)
+        ]
+
+    async def start_recording():
+        await asyncio.sleep(warmup)
+        stats.recording = True
+
+    await asyncio.gather(start_recording(), *clients)
+    return stats
+
+
+def percentile(values: list, percent: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def run(listener: str, scenario: str, args, data_path: str, certificate: tuple) -> dict:
+    # Spawn rather than fork so the server's memory use doesn't include
+    # anything from this process.
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    server = context.Process(
+        target=serve,
+        args=(listener, scenario, data_path, certificate, args.port, args.uvloop, ready),
+        daemon=True,
+    )
+    server.start()
+    ready.wait()
+    try:
+        stats = asyncio.run(load(
+            listener, args.port, SCENARIOS[scenario].encode() + b"\r\n",
+            args.concurrency, args.warmup, args.duration,
+        ))
+        rss, peak_rss = memory_kib(server.pid)
+    finally:
+        server.terminate()
+        server.join()
+
+    latencies = sorted(stats.latencies)
+    return {
+        "listener": listener,
+        "scenario": scenario,
+        "requests": len(latencies),
+        "errors": stats.errors,
+        "requests_per_second": len(latencies) / args.duration,
+        "bytes_per_second": stats.bytes / args.duration,
+        "latency_ms": {
+            name: percentile(latencies, percent) * 1000 if latencies else None
+            for name, percent in (("p50", 50), ("p90", 90), ("p99", 99), ("max", 100))
+        },
+        "server_rss_kib": rss,
+        "server_peak_rss_kib": peak_rss,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], check=True, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result: dict, baseline: dict=None):
+    latency = result["latency_ms"]
+    line = "%-5s %-14s %9.0f req/s %9.1f MB/s  p50 %7.2f ms  p99 %7.2f ms  rss %s KiB" % (
+        result["listener"], result["scenario"], result["requests_per_second"],
+        result["bytes_per_second"] / 1e6, latency["p50"] or 0, latency["p99"] or 0,
+        result["server_peak_rss_kib"],
+    )
+    if baseline is not None and baseline["requests_per_second"] and baseline["latency_ms"]["p99"]:
+        line += "  (%+.1f%% req/s, %+.1f%% p99)" % (
+            (result["requests_per_second"] / baseline["requests_per_second"] - 1) * 100,
+            ((latency["p99"] or 0) / baseline["latency_ms"]["p99"] - 1) * 100,
+        )
+    print(line)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--port", type=int, default=7070)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--warmup", type=float, default=1)
+    parser.add_argument("--listeners", nargs="+", choices=LISTENERS, default=LISTENERS)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--large-size", type=int, default=4 * 1024 * 1024)
+    parser.add_argument("--menu-entries", type=int, default=5000)
+    parser.add_argument("--certificate", nargs=2, metavar=("CERTIFICATE", "PRIVATE_KEY"))
+    parser.add_argument("--uvloop", action="store_true", help="run the server with uvloop")
+    parser.add_argument("--output", help="file to write the results to as JSON")
+    parser.add_argument("--compare", help="JSON results from an earlier run to compare with")
+    args = parser.parse_args()
+
+    if args.uvloop and uvloop is None:
+        parser.error("uvloop is not installed.")
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {
+                (result["listener"], result["scenario"]): result
+                for result in json.load(f)["results"]
+            }
+
+    listeners = args.listeners
+    if "quic" in listeners and not QUIC_ENABLED:
+        print("Skipping quic: aioquic is not installed.", file=sys.stderr)
+        listeners = [listener for listener in listeners if listener != "quic"]
+
+    results = []
+    with tempfile.TemporaryDirectory() as data_path:
+        create_data(data_path, args.large_size, args.menu_entries)
+
+        certificate = args.certificate
+        if certificate is None and set(listeners) & {"tls", "quic"}:
+            try:
+                certificate = create_certificate(data_path)
+            except (OSError, subprocess.CalledProcessError):
+                print("Skipping tls and quic: couldn't create a certificate.", file=sys.stderr)
+                listeners = ["tcp"] if "tcp" in listeners else []
+
+        for listener in listeners:
+            for scenario in args.scenarios:
+                result = run(listener, scenario, args, data_path, certificate)
+                print_result(result, baseline.get((listener, scenario)))
+                results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "commit": git_commit(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "event_loop": "uvloop" if args.uvloop else "asyncio",
+                "settings": {
+                    "concurrency": args.concurrency,
+                    "duration": args.duration,
+                    "warmup": args.warmup,
+                    "large_size": args.large_size,
+                    "menu_entries": args.menu_entries,
+                },
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
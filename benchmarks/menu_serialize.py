@@ -0,0 +1,49 @@
+"""
+Times building and serialising a large menu.
+
+Compares the previous path (Menu.serialize, then encoding and line ending
+conversion as Application used to do) with Menu.serialize_bytes.
+
+    python benchmarks/menu_serialize.py
+"""
+
+import timeit
+
+from argparse import ArgumentParser
+
+from gopher_server.menu import Menu, MenuItem
+
+
+def build(items: int) -> Menu:
+    return Menu(
+        MenuItem("0", "file%05d.txt" % i, "dir/file%05d.txt" % i, "localhost", 7000)
+        for i in range(items)
+    )
+
+
+def serialize_and_encode(menu: Menu) -> bytes:
+    response = menu.serialize().encode("utf-8").replace(b"\n", b"\r\n")
+    if not response.endswith(b"\r\n"):
+        response += b"\r\n"
+    return response + b".\r\n"
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--number", type=int, default=20)
+    args = parser.parse_args()
+
+    menu = build(args.items)
+    timings = {
+        "build": lambda: build(args.items),
+        "serialize + encode": lambda: serialize_and_encode(menu),
+        "serialize_bytes": menu.serialize_bytes,
+    }
+    for name, func in timings.items():
+        seconds = min(timeit.repeat(func, number=args.number, repeat=5)) / args.number
+        print("%-20s %8.2f ms" % (name, seconds * 1000))
+
+
+if __name__ == "__main__":
+    main()
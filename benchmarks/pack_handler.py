@@ -0,0 +1,65 @@
+"""
+Compares DirectoryHandler with PackHandler for a tree of small text files.
+
+Measures the time to dispatch a request for each handler, the time to build
+the pack, and the time to open it, which shouldn't depend on the pack's size.
+
+    python benchmarks/pack_handler.py
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+
+from argparse import ArgumentParser
+
+from gopher_server.application import Application
+from gopher_server.handlers import DirectoryHandler
+from gopher_server.pack import PackHandler, build_pack
+
+
+async def measure(application: Application, selectors: list) -> float:
+    start = time.perf_counter()
+    for selector in selectors:
+        await application.dispatch("localhost", 7000, selector)
+    return (time.perf_counter() - start) / len(selectors)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--files", type=int, default=10000)
+    parser.add_argument("--size", type=int, default=2048)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        base_path = os.path.join(path, "data")
+        line = "hello gopher world, this is a line of text\n"
+        for i in range(args.files):
+            directory = os.path.join(base_path, "dir%03d" % (i % 100))
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, "file%06d.txt" % i), "w") as f:
+                f.write(line * (args.size // len(line)))
+        selectors = [
+            ("dir%03d/file%06d.txt\r\n" % (i % 100, i)).encode() for i in range(args.files)
+        ]
+
+        pack_path = os.path.join(path, "data.pack")
+        start = time.perf_counter()
+        build_pack(base_path, pack_path)
+        print("build pack        %8.2f s" % (time.perf_counter() - start))
+
+        start = time.perf_counter()
+        pack_handler = PackHandler(pack_path)
+        print("open pack         %8.2f ms" % ((time.perf_counter() - start) * 1000))
+
+        for name, handler in (
+            ("DirectoryHandler", DirectoryHandler(base_path)),
+            ("PackHandler", pack_handler),
+        ):
+            seconds = asyncio.run(measure(Application(handler), selectors))
+            print("%-17s %8.2f us/request" % (name, seconds * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measures PatternHandler lookup cost against the number of registered routes.
+
+Each run registers an equal mix of static and dynamic routes, then times
+lookups for the last registered route of each kind (the worst case for a
+linear scan). The linear scan which PatternHandler used previously is timed
+alongside it for comparison.
+
+    python benchmarks/pattern_router.py
+"""
+
+import asyncio
+import time
+
+from argparse import ArgumentParser
+
+from gopher_server.handlers import NotFound, PatternHandler, Request
+
+
+def view(request, **kwargs):
+    return "ok"
+
+
+def build_handler(routes: int) -> PatternHandler:
+    handler = PatternHandler()
+    for i in range(routes // 2):
+        handler.register("static/%s" % i)(view)
+        handler.register("dynamic/%s/(?P<id>[0-9]+)" % i)(view)
+    return handler
+
+
+async def linear_scan(handler: PatternHandler, request: Request):
+    for pattern, func in handler.patterns:
+        match = pattern.match(request.selector)
+        if match:
+            return func(request, **match.groupdict())
+    raise NotFound
+
+
+async def time_lookups(handle, selectors, iterations: int) -> float:
+    requests = [Request("localhost", 7000, selector) for selector in selectors]
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for request in requests:
+            await handle(request)
+    return (time.perf_counter() - start) / (iterations * len(requests))
+
+
+async def run(route_counts, iterations: int):
+    print("%8s %14s %14s" % ("routes", "linear (us)", "router (us)"))
+    for routes in route_counts:
+        handler = build_handler(routes)
+        last = routes // 2 - 1
+        selectors = ["static/%s" % last, "dynamic/%s/123" % last]
+        linear = await time_lookups(lambda r: linear_scan(handler, r), selectors, iterations)
+        router = await time_lookups(handler.handle, selectors, iterations)
+        print("%8s %14.2f %14.2f" % (routes, linear * 1e6, router * 1e6))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--routes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(run(args.routes, args.iterations))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares requests per second for tcp_listener and tcp_protocol_listener.
+
+The server runs in a separate process serving a small file from the example
+data, and a number of concurrent clients in this process make requests for a
+fixed amount of time. Each listener is run with the default asyncio event
+loop, and with uvloop if it's installed.
+
+    python benchmarks/tcp_listeners.py
+"""
+
+import asyncio
+import multiprocessing
+import os.path
+import time
+
+from argparse import ArgumentParser
+
+from gopher_server.application import Application
+from gopher_server.handlers import DirectoryHandler
+from gopher_server.listeners import tcp_listener, tcp_protocol_listener
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+BASE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples/data/")
+
+LISTENERS = {
+    "tcp_listener": tcp_listener,
+    "tcp_protocol_listener": tcp_protocol_listener,
+}
+
+
+def serve(listener_name: str, use_uvloop: bool, port: int, ready):
+    if use_uvloop:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    loop = asyncio.new_event_loop()
+    application = Application(DirectoryHandler(BASE_PATH))
+    loop.run_until_complete(LISTENERS[listener_name](application, "localhost", "127.0.0.1", port))
+    ready.set()
+    loop.run_forever()
+
+
+async def client(port: int, deadline: float, counts: list):
+    while time.perf_counter() < deadline:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"example\r\n")
+        await reader.read()
+        writer.close()
+        counts.append(1)
+
+
+async def load(port: int, concurrency: int, duration: float) -> float:
+    counts = []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(client(port, deadline, counts) for _ in range(concurrency)))
+    return len(counts) / duration
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--port", type=int, default=7070)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=5)
+    args = parser.parse_args()
+
+    for use_uvloop in (False, True) if uvloop else (False,):
+        for listener_name in LISTENERS:
+            ready = multiprocessing.Event()
+            server = multiprocessing.Process(
+                target=serve, args=(listener_name, use_uvloop, args.port, ready), daemon=True,
+            )
+            server.start()
+            ready.wait()
+            try:
+                rate = asyncio.run(load(args.port, args.concurrency, args.duration))
+            finally:
+                server.terminate()
+                server.join()
+            print("%-22s %-8s %8.0f req/s" % (
+                listener_name, "uvloop" if use_uvloop else "asyncio", rate,
+            ))
+
+
+if __name__ == "__main__":
+    main()
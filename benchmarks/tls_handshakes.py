@@ -0,0 +1,133 @@
+"""
+Compares TLS connections per second with and without session resumption.
+
+The server runs tcp_tls_listener in a separate process, and a few client
+threads in this process repeatedly connect, send a selector for a small text
+file and read the response. Each client either does a full handshake every
+time, or resumes the session from its previous connection using session
+tickets or the server's session cache.
+
+A self-signed RSA certificate is created with `openssl` unless one is given.
+RSA signatures are slow enough that the full handshakes are noticeably
+more expensive.
+
+    python benchmarks/tls_handshakes.py
+"""
+
+import asyncio
+import multiprocessing
+import os.path
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+
+from argparse import ArgumentParser
+
+from gopher_server.application import Application
+from gopher_server.handlers import DirectoryHandler
+from gopher_server.listeners import tcp_tls_listener
+
+
+BASE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples/data/")
+
+MODES = {
+    # name: (server session_tickets, client resumes)
+    "full handshake": (True, False),
+    "session tickets": (True, True),
+    "session cache": (False, True),
+}
+
+
+def serve(port: int, certificate: tuple, session_tickets: bool, ciphers: str, ready):
+    loop = asyncio.new_event_loop()
+    application = Application(DirectoryHandler(BASE_PATH))
+    loop.run_until_complete(tcp_tls_listener(
+        application, "localhost", "127.0.0.1", port, *certificate,
+        ciphers=ciphers, session_tickets=session_tickets,
+    ))
+    ready.set()
+    loop.run_forever()
+
+
+def client(port: int, resume: bool, deadline: float, results: list):
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    session = None
+    connections = resumed = 0
+    while time.perf_counter() < deadline:
+        with socket.create_connection(("127.0.0.1", port)) as sock:
+            with context.wrap_socket(sock, server_hostname="localhost", session=session) as tls_sock:
+                tls_sock.sendall(b"example\r\n")
+                while tls_sock.recv(65536):
+                    pass
+                connections += 1
+                resumed += tls_sock.session_reused
+                if resume:
+                    session = tls_sock.session
+    results.append((connections, resumed))
+
+
+def create_certificate(path: str) -> tuple:
+    certificate_path = os.path.join(path, "server.crt")
+    private_key_path = os.path.join(path, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=localhost", "-keyout", private_key_path, "-out", certificate_path,
+        ],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    return certificate_path, private_key_path
+
+
+def run(args, certificate: tuple, session_tickets: bool, resume: bool):
+    context = multiprocessing.get_context("spawn")
+    ready = context.Event()
+    server = context.Process(
+        target=serve,
+        args=(args.port, certificate, session_tickets, args.ciphers, ready),
+        daemon=True,
+    )
+    server.start()
+    ready.wait()
+    try:
+        results = []
+        deadline = time.perf_counter() + args.duration
+        threads = [
+            threading.Thread(target=client, args=(args.port, resume, deadline, results))
+            for _ in range(args.clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.join()
+    connections = sum(result[0] for result in results)
+    resumed = sum(result[1] for result in results)
+    return connections / args.duration, resumed / max(connections, 1)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--port", type=int, default=7071)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--ciphers", help="OpenSSL cipher string for the server")
+    parser.add_argument("--certificate", nargs=2, metavar=("CERTIFICATE", "PRIVATE_KEY"))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        certificate = args.certificate or create_certificate(path)
+        for name, (session_tickets, resume) in MODES.items():
+            rate, resumed = run(args, certificate, session_tickets, resume)
+            print("%-16s %8.0f connections/s  %5.1f%% resumed" % (name, rate, resumed * 100))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Compares running a CPU-bound PatternHandler view on the event loop, in a
+thread pool and in a process pool.
+
+Each run sends a batch of concurrent requests to a view which does a fixed
+amount of pure Python work, and reports the total time along with the
+longest a trivial "ping" request had to wait while the batch was running.
+On the event loop the ping waits for the whole batch, and threads are held
+back by the GIL, while the process pool spreads the work across cores.
+
+    python benchmarks/view_executors.py --requests 32 --processes 4
+"""
+
+import asyncio
+import time
+
+from argparse import ArgumentParser
+
+from gopher_server.handlers import PatternHandler, Request
+
+
+def render(request, size: str):
+    total = 0
+    for i in range(int(size)):
+        total += i * i % 7
+    return "%s\n" % total
+
+
+def ping(request):
+    return "pong"
+
+
+async def run(executor: str, args) -> tuple:
+    handler = PatternHandler(threads=args.processes, processes=args.processes)
+    handler.register("render/(?P<size>[0-9]+)", executor=executor)(render)
+    handler.register("ping")(ping)
+
+    # Warm up the pool so starting it isn't timed.
+    await handler.handle(Request("localhost", 7000, "render/1"))
+
+    selector = "render/%s" % args.size
+    start = time.perf_counter()
+    batch = asyncio.gather(*[
+        handler.handle(Request("localhost", 7000, selector)) for _ in range(args.requests)
+    ])
+    longest_ping = 0.0
+    while not batch.done():
+        ping_start = time.perf_counter()
+        await asyncio.sleep(0)
+        await handler.handle(Request("localhost", 7000, "ping"))
+        longest_ping = max(longest_ping, time.perf_counter() - ping_start)
+        await asyncio.sleep(0.001)
+    await batch
+    return time.perf_counter() - start, longest_ping
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--size", type=int, default=200000, help="loop iterations per request")
+    parser.add_argument("--processes", type=int, default=4, help="size of the pools")
+    args = parser.parse_args()
+
+    print("%-10s %10s %16s" % ("executor", "total (s)", "worst ping (ms)"))
+    for executor in [None, "thread", "process"]:
+        total, longest_ping = asyncio.run(run(executor, args))
+        print("%-10s %10.3f %16.1f" % (executor or "loop", total, longest_ping * 1000))
+
+
+if __name__ == "__main__":
+    main()
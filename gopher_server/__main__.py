@@ -1,21 +1,94 @@
+import signal
+
 from argparse import ArgumentParser
-from asyncio import get_event_loop
+from asyncio import new_event_loop, set_event_loop, set_event_loop_policy
+from functools import partial
+from logging import INFO, basicConfig
 
 from gopher_server.application import Application
 from gopher_server.handlers import DirectoryHandler
-from gopher_server.listeners import tcp_listener
+from gopher_server.listeners import (
+    quic_listener, reload_tls_certificates, tcp_listener, tcp_tls_listener,
+)
+from gopher_server.tracing import Tracer
 
 
 parser = ArgumentParser("gopher_server")
 parser.add_argument("base_path", nargs="?", default=".")
+parser.add_argument("--host", default="0.0.0.0", help="address to listen on")
+parser.add_argument("--port", type=int, default=7000, help="TCP port to listen on")
+parser.add_argument("--hostname", default="localhost",
+                    help="hostname for links in generated menus")
+parser.add_argument("--generate-menus", action="store_true",
+                    help="serve generated menus for directories instead of their index files")
+parser.add_argument("--certificate", help="TLS certificate file")
+parser.add_argument("--private-key", help="TLS private key file")
+parser.add_argument("--tls-port", type=int, help="port to listen on for TLS")
+parser.add_argument("--quic-port", type=int, help="UDP port to listen on for QUIC")
+parser.add_argument("--workers", type=int, default=1,
+                    help="number of worker processes to serve from")
+parser.add_argument("--uvloop", action="store_true", help="use the uvloop event loop")
+parser.add_argument("--slow-requests", type=float, metavar="SECONDS",
+                    help="log requests which take longer than this")
+parser.add_argument("--profile-rate", type=float, metavar="FRACTION",
+                    help="profile this fraction of requests after SIGUSR2 is received")
+parser.add_argument("--profile-dir", default=".", help="directory to write profiles to")
 args = parser.parse_args()
 
+if (args.tls_port or args.quic_port) and not (args.certificate and args.private_key):
+    parser.error("--tls-port and --quic-port need --certificate and --private-key.")
+if args.quic_port and args.workers > 1:
+    parser.error("--quic-port can't be used with --workers.")
+
+if args.uvloop:
+    try:
+        import uvloop
+    except ImportError:
+        parser.error("uvloop is not installed. Please install the [uvloop] extras.")
+    set_event_loop_policy(uvloop.EventLoopPolicy())
+
+basicConfig(level=INFO)
+
+
+handler = DirectoryHandler(args.base_path, generate_menus=args.generate_menus)
+tracer = None
+if args.slow_requests is not None or args.profile_rate is not None:
+    tracer = Tracer(args.slow_requests, profile_dir=args.profile_dir)
+    if args.profile_rate is not None:
+        tracer.profile_rate = args.profile_rate
+application = Application(handler, tracer=tracer)
 
-handler = DirectoryHandler(args.base_path)
-application = Application(handler)
+reuse_port = args.workers > 1
+listeners = [partial(
+    tcp_listener, hostname=args.hostname, host=args.host, port=args.port, reuse_port=reuse_port,
+)]
+ports = ["port %s" % args.port]
+if args.tls_port:
+    listeners.append(partial(
+        tcp_tls_listener, hostname=args.hostname, host=args.host, port=args.tls_port,
+        certificate_path=args.certificate, private_key_path=args.private_key,
+        reuse_port=reuse_port,
+    ))
+    ports.append("TLS port %s" % args.tls_port)
+if args.quic_port:
+    listeners.append(partial(
+        quic_listener, hostname=args.hostname, host=args.host, port=args.quic_port,
+        certificate_path=args.certificate, private_key_path=args.private_key,
+    ))
+    ports.append("QUIC port %s" % args.quic_port)
 
 
-loop = get_event_loop()
-loop.create_task(tcp_listener(application, "localhost", "0.0.0.0", 7000))
-print("Serving on 0.0.0.0 port 7000...")
-loop.run_forever()
+if args.workers > 1:
+    from gopher_server.workers import run_workers
+    print("Serving on %s %s with %s workers..." % (args.host, ", ".join(ports), args.workers))
+    run_workers(application, listeners, args.workers)
+else:
+    loop = new_event_loop()
+    set_event_loop(loop)
+    loop.add_signal_handler(signal.SIGHUP, reload_tls_certificates)
+    if tracer is not None:
+        loop.add_signal_handler(signal.SIGUSR2, tracer.toggle_profiling)
+    for listener in listeners:
+        loop.run_until_complete(listener(application))
+    print("Serving on %s %s..." % (args.host, ", ".join(ports)))
+    loop.run_forever()
@@ -1,11 +1,24 @@
+import re
+
+from collections.abc import AsyncIterable
 from dataclasses import dataclass
+from functools import partial
 from logging import getLogger
+from time import perf_counter
+from typing import AsyncIterator, List, Union
 
+from gopher_server.cache import ResponseCache
 from gopher_server.handlers import IHandler, NotFound, Request
-from gopher_server.menu import Menu
+from gopher_server.metrics import Metrics
+from gopher_server.middleware import IMiddleware, chain
+from gopher_server.responses import FileResponse, _aclose, _ClosingIterator, encode_response
+from gopher_server.tracing import Tracer, current_trace, span
 
 log = getLogger(__name__)
 
+# Characters which aren't allowed in selectors.
+_INVALID_SELECTOR = re.compile("[\t\r\n]")
+
 
 @dataclass
 class Application:
@@ -18,11 +31,42 @@ class Application:
     .. note:: The bytes<->string conversion uses UTF-8, but the Gopher RFC
               specifies ASCII encoding. Some clients may have issues if you
               use characters outside the ASCII range.
+
+    Responses can be cached by passing a :class:`ResponseCache
+    <gopher_server.cache.ResponseCache>` as the `cache` argument. Cached
+    responses are served without calling the handler at all.
+
+    Passing a :class:`Metrics <gopher_server.metrics.Metrics>` object as the
+    `metrics` argument records request latencies and other statistics, and a
+    :class:`Tracer <gopher_server.tracing.Tracer>` as the `tracer` argument
+    logs slow requests with a breakdown of where the time went.
+
+    `middleware` is a list of :class:`IMiddleware
+    <gopher_server.middleware.IMiddleware>` objects which are run in order
+    around the handler:
+
+    .. code-block::
+
+       application = Application(handler, middleware=[
+           TimingMiddleware(slow_threshold=1),
+           CacheMiddleware(ResponseCache(max_bytes=64 * 1024 * 1024)),
+       ])
     """
 
     handler: IHandler
-
-    async def dispatch(self, hostname: str, port: int, selector: bytes) -> bytes:
+    cache: ResponseCache = None
+    metrics: Metrics = None
+    tracer: Tracer = None
+    middleware: List[IMiddleware] = None
+
+    def __post_init__(self):
+        self._handler_name = type(self.handler).__name__
+        self._pipeline = chain(self.middleware or [], self.handler)
+        if self.metrics is not None and self.cache is not None:
+            self.metrics.caches["response"] = self.cache
+
+    async def dispatch(self, hostname: str, port: int,
+                       selector: bytes) -> Union[bytes, FileResponse, AsyncIterator[bytes]]:
         """
         Dispatches a request.
 
@@ -31,36 +75,127 @@ class Application:
         :class:`Request <gopher_server.handlers.Request>` object so that
         handlers which generate a menu can include the right values for local
         selectors.
+
+        :class:`FileResponse <gopher_server.responses.FileResponse>` objects
+        are passed back unchanged so the listener can stream the file itself,
+        and :class:`EncodedResponse <gopher_server.responses.EncodedResponse>`
+        objects are sent as they are.
+
+        If the handler returns an async iterator, this returns an async
+        iterator of encoded chunks. The first chunk is fetched before
+        returning, so errors raised by the handler before it produces any
+        output are still turned into error responses.
         """
 
+        # Listeners start the trace themselves so it includes reading the
+        # selector and writing the response.
+        if self.tracer is not None and current_trace() is None:
+            with self.tracer.trace():
+                return await self._measured_dispatch(hostname, port, selector)
+        return await self._measured_dispatch(hostname, port, selector)
+
+    async def _measured_dispatch(self, hostname: str, port: int, selector: bytes):
+        if self.metrics is None:
+            response, outcome, request = await self._dispatch(hostname, port, selector)
+            return response
+
+        start = perf_counter()
+        self.metrics.requests_in_flight += 1
+        try:
+            response, outcome, request = await self._dispatch(hostname, port, selector)
+        finally:
+            self.metrics.requests_in_flight -= 1
+        self.metrics.observe_request(
+            self._handler_name, request and request.pattern, outcome, perf_counter() - start,
+        )
+        return response
+
+    async def _dispatch(self, hostname: str, port: int, selector: bytes):
+        """Dispatches a request, and returns the response, outcome and request."""
+
         try:
             decoded_selector = selector.decode("utf-8")
         except UnicodeDecodeError:
-            return b"3Bad selector.\t\terror.host\t0\r\n.\r\n"
+            return b"3Bad selector.\t\terror.host\t0\r\n.\r\n", "bad_selector", None
 
         decoded_selector = decoded_selector.strip()
 
-        if "\t" in decoded_selector or "\r" in decoded_selector or "\n" in decoded_selector:
-            return b"3Bad selector.\t\terror.host\t0\r\n.\r\n"
+        if _INVALID_SELECTOR.search(decoded_selector):
+            return b"3Bad selector.\t\terror.host\t0\r\n.\r\n", "bad_selector", None
+
+        if self.cache is not None:
+            cache_key = (decoded_selector, hostname, port)
+            cached_response = await self.cache.get_async(cache_key)
+            if cached_response is not None:
+                return cached_response, "cache_hit", None
 
         request = Request(hostname, port, decoded_selector)
+        trace = current_trace()
+        if trace is not None:
+            trace.selector = decoded_selector
 
         try:
-            response = await self.handler.handle(request)
+            with span("handler"):
+                response = await self._pipeline.handle(request)
+                if isinstance(response, AsyncIterable):
+                    chunks = response.__aiter__()
+                    try:
+                        first_chunk = await chunks.__anext__()
+                    except StopAsyncIteration:
+                        first_chunk = ""
         except NotFound:
-            return b"3Not found.\t\terror.host\t0\r\n.\r\n"
+            return b"3Not found.\t\terror.host\t0\r\n.\r\n", "not_found", request
         except Exception as e:
             log.error("Caught exception:", exc_info=e)
-            return b"3Internal server error.\t\terror.host\t0\r\n.\r\n"
+            return b"3Internal server error.\t\terror.host\t0\r\n.\r\n", "error", request
 
-        if isinstance(response, Menu):
-            response = response.serialize()
+        if isinstance(response, AsyncIterable):
+            # Closing the encoded stream closes the handler's iterator too.
+            stream = _ClosingIterator(self._stream(first_chunk, chunks), partial(_aclose, chunks))
+            return stream, "ok", request
 
-        if isinstance(response, str):
-            encoded_response = response.encode("utf-8")
-            encoded_response = encoded_response.replace(b"\n", b"\r\n")
-            if not encoded_response.endswith(b"\r\n"):
-                encoded_response += b"\r\n"
-            return encoded_response + b".\r\n"
+        with span("serialize"):
+            data = encode_response(response)
+        if data is not None:
+            response = data
 
-        return response
+        if self.cache is not None and request.dependencies and isinstance(response, bytes):
+            self.cache.set(cache_key, response, request.dependencies)
+
+        return response, "ok", request
+
+    async def _stream(self, first_chunk, chunks) -> AsyncIterator[bytes]:
+        """
+        Encodes a streamed response.
+
+        If the first chunk is bytes then the response is treated as binary and
+        passed through unchanged. Otherwise it's treated as text in the same
+        way as a string response, with the line ending conversion done chunk
+        by chunk. Text streams may also yield menu items, which are serialised
+        as one line each.
+        """
+
+        text = not isinstance(first_chunk, bytes)
+        ends_with_newline = False
+
+        chunk = first_chunk
+        try:
+            while True:
+                if text:
+                    if not isinstance(chunk, str):
+                        chunk = chunk.serialize() + "\n"
+                    chunk = chunk.encode("utf-8").replace(b"\n", b"\r\n")
+                    if chunk:
+                        ends_with_newline = chunk.endswith(b"\r\n")
+                if chunk:
+                    yield chunk
+                chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            pass
+        except Exception as e:
+            # It's too late to send an error response, so just cut it short.
+            log.error("Caught exception:", exc_info=e)
+            return
+
+        if text:
+            yield b".\r\n" if ends_with_newline else b"\r\n.\r\n"
@@ -0,0 +1,122 @@
+import asyncio
+import os
+
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Hashable, List, Optional, Tuple
+
+
+class ResponseCache:
+    """
+    In-memory LRU cache of encoded responses.
+
+    Pass an instance to an :class:`Application
+    <gopher_server.application.Application>` to enable caching. Only
+    responses generated from files are cached: handlers record the files they
+    used in :attr:`Request.dependencies <gopher_server.handlers.Request>`, and
+    a cached response is thrown away as soon as the modification time of any
+    of those files changes.
+
+    The total size of the cached responses is kept under `max_bytes` by
+    evicting the least recently used entries. The `hits`, `misses` and
+    `evictions` counters can be used to check how effective the cache is.
+
+    Checking the files involves a `stat` call for each of them. On slow disks
+    or network file systems, pass an `executor` (such as a
+    :class:`concurrent.futures.ThreadPoolExecutor`) to make those calls in
+    :meth:`get_async` without blocking the event loop.
+    """
+
+    def __init__(self, max_bytes: int, executor: Executor=None):
+        self.max_bytes = max_bytes
+        self.executor = executor
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        """
+        Returns the cached response for `key`, or `None` if it isn't cached or
+        any of its files have changed.
+        """
+
+        entry = self._entries.get(key)
+        return self._checked(key, entry, entry is not None and _unchanged(entry[1]))
+
+    async def get_async(self, key: Hashable) -> Optional[bytes]:
+        """
+        Like :meth:`get`, but checks the files in the cache's `executor` if it
+        has one. This is what :class:`Application
+        <gopher_server.application.Application>` uses.
+        """
+
+        entry = self._entries.get(key)
+        if entry is None or self.executor is None:
+            return self._checked(key, entry, entry is not None and _unchanged(entry[1]))
+
+        unchanged = await asyncio.get_running_loop().run_in_executor(
+            self.executor, _unchanged, entry[1],
+        )
+        # The entry may have been replaced or evicted in the meantime.
+        if self._entries.get(key) is not entry:
+            self.misses += 1
+            return None
+        return self._checked(key, entry, unchanged)
+
+    def _checked(self, key: Hashable, entry, unchanged: bool) -> Optional[bytes]:
+        if entry is None:
+            self.misses += 1
+            return None
+
+        if not unchanged:
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: Hashable, data: bytes, dependencies: List[Tuple[str, int]]):
+        """
+        Caches a response. `dependencies` is a list of `(path, st_mtime_ns)`
+        tuples for the files the response was generated from.
+        """
+
+        if len(data) > self.max_bytes:
+            return
+
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (data, dependencies)
+        self.size += len(data)
+
+        while self.size > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def clear(self):
+        """Removes all cached responses."""
+        self._entries.clear()
+        self.size = 0
+
+    def _remove(self, key: Hashable):
+        data, dependencies = self._entries.pop(key)
+        self.size -= len(data)
+
+
+def _unchanged(dependencies: List[Tuple[str, int]]) -> bool:
+    """Checks none of the files a response was generated from have changed."""
+    for path, mtime in dependencies:
+        try:
+            if os.stat(path).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    return True
@@ -1,34 +1,72 @@
+import asyncio
+import contextvars
 import os.path
 import re
-
-try:
-    import filetype
-    FILETYPE_ENABLED = True
-except ImportError:
-    FILETYPE_ENABLED = False
-
-from dataclasses import dataclass
-from inspect import iscoroutinefunction
+import stat
+
+from codecs import getincrementaldecoder
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from importlib.util import find_spec
+from inspect import isasyncgenfunction, iscoroutinefunction
 from logging import getLogger
-from typing import Union
+from typing import AsyncIterator, List, Tuple, Union
 from zope.interface import Interface, implementer
 
 from gopher_server.menu import Menu, MenuItem
+from gopher_server.responses import (
+    CHUNK_SIZE, EncodedResponse, FileResponse, _read_chunks, encode_response,
+)
+from gopher_server.tracing import span
 
 log = getLogger(__name__)
 
+_BUSY_RESPONSE = b"3Server busy.\t\terror.host\t0\r\n.\r\n"
+
+# filetype is only imported the first time a file's type has to be sniffed,
+# so it doesn't slow down starting servers which never generate menus.
+FILETYPE_ENABLED = find_spec("filetype") is not None
 
+
+# Requests are plain dataclasses so they can be pickled and sent to a
+# process pool by PatternHandler.
 @dataclass
 class Request:
     hostname: str
     port:     int
     selector: str
 
+    #: `(path, st_mtime_ns)` tuples for the files the response was generated
+    #: from. Handlers which fill this in allow their responses to be cached
+    #: by a :class:`ResponseCache <gopher_server.cache.ResponseCache>`.
+    dependencies: List[Tuple[str, int]] = field(
+        default_factory=list, init=False, repr=False, compare=False,
+    )
+
+    #: The pattern which matched the selector, if the request was handled by
+    #: a :class:`PatternHandler`. This is used to group requests in metrics.
+    pattern: str = field(default=None, init=False, repr=False, compare=False)
+
 
 class NotFound(Exception):
     pass
 
 
+async def _stream_text_file(path: str, executor: Executor=None) -> AsyncIterator[bytes]:
+    """Yields a text file encoded for sending, a chunk at a time."""
+    ends_with_newline = False
+    chunks = _read_chunks(path, executor)
+    try:
+        async for chunk in chunks:
+            ends_with_newline = chunk.endswith(b"\n")
+            yield chunk.replace(b"\n", b"\r\n")
+    finally:
+        await chunks.aclose()
+    yield b".\r\n" if ends_with_newline else b"\r\n.\r\n"
+
+
 class IHandler(Interface):
     """
     Interface for handler classes.
@@ -38,26 +76,94 @@ class IHandler(Interface):
     the view layer in web frameworks).
     """
 
-    async def handle(self, request: Request) -> Union[str, bytes, Menu]:
+    async def handle(self, request: Request) -> Union[str, bytes, Menu, FileResponse,
+                                                      EncodedResponse, AsyncIterator]:
         """
         Receives a :class:`Request <gopher_server.handlers.Request>` object,
         and returns the response as either a string (for text responses), bytes
-        (for binary responses), or a :class:`Menu <gopher_server.menu.Menu>`
-        object. May also raise
+        (for binary responses), a :class:`Menu <gopher_server.menu.Menu>`
+        object, or a :class:`FileResponse <gopher_server.responses.FileResponse>`
+        (for binary files which should be streamed from disk), or an
+        :class:`EncodedResponse <gopher_server.responses.EncodedResponse>`
+        (for text which has already been encoded). May also raise
         :class:`NotFound <gopher_server.handlers.NotFound>`.
+
+        Large or slow responses can instead be returned as an async iterator.
+        An iterator of strings (or menu items) is sent as text, and an
+        iterator of bytes is sent as binary. Chunks are sent to the client as
+        soon as they're produced.
         """
         pass
 
 
-def _file_type(path):
-    if os.path.isdir(path):
+# Types which can be decided from the file extension alone, without opening
+# the file to sniff its contents.
+_EXTENSION_TYPES = {
+    ".txt":  "0",
+    ".log":  "0",
+    ".md":   "0",
+    ".csv":  "0",
+    ".gif":  "g",
+    ".png":  "I",
+    ".jpg":  "I",
+    ".jpeg": "I",
+    ".bmp":  "I",
+    ".webp": "I",
+    ".ico":  "I",
+    ".tif":  "I",
+    ".tiff": "I",
+    ".mp3":  "s",
+    ".ogg":  "s",
+    ".wav":  "s",
+    ".flac": "s",
+    ".m4a":  "s",
+}
+
+# Sniffed types, keyed on (device, inode, mtime, size) so they're re-checked
+# whenever the file changes. Menus can be generated from several io_threads at
+# once, so entries are evicted with popitem(), which can't fail part way
+# through like iterating over the dict can.
+_file_type_cache = OrderedDict()
+_FILE_TYPE_CACHE_SIZE = 65536
+
+_filetype_warning_logged = False
+
+
+def _file_type(entry: os.DirEntry) -> str:
+    if entry.is_dir():
         return "1"
+
+    file_type = _EXTENSION_TYPES.get(os.path.splitext(entry.name)[1].lower())
+    if file_type is not None:
+        return file_type
+
     if not FILETYPE_ENABLED:
-        log.warn(
-            "The filetype dependency is not installed. "
-            "Defaulting to 0 (text)."
-        )
+        global _filetype_warning_logged
+        if not _filetype_warning_logged:
+            log.warning(
+                "The filetype dependency is not installed. "
+                "Defaulting to 0 (text)."
+            )
+            _filetype_warning_logged = True
         return "0" # text
+
+    entry_stat = entry.stat()
+    key = (entry_stat.st_dev, entry_stat.st_ino, entry_stat.st_mtime_ns, entry_stat.st_size)
+    file_type = _file_type_cache.get(key)
+    if file_type is None:
+        with span("file_type"):
+            file_type = _guess_file_type(entry.path)
+        if len(_file_type_cache) >= _FILE_TYPE_CACHE_SIZE:
+            try:
+                _file_type_cache.popitem(last=False)
+            except KeyError:
+                pass
+        _file_type_cache[key] = file_type
+    return file_type
+
+
+def _guess_file_type(path: str) -> str:
+    import filetype
     kind = filetype.guess(path)
     if kind is None:
         return "0" # text
@@ -70,15 +176,32 @@ def _file_type(path):
     return "9" # binary
 
 
-def _menu_from_directory(request, path):
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _directory_entries(path: str, start: int=0, stop: int=None) -> List[Tuple[str, str]]:
+    """
+    Returns `(type, name)` tuples for the entries in a directory. `start` and
+    `stop` select a slice of the sorted entries, so only those entries need
+    their type detected.
+    """
+    with span("list_directory"), os.scandir(path) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    return [(_file_type(entry), entry.name) for entry in entries[start:stop]]
+
+
+def _menu_from_entries(request, selector, entries):
     menu = Menu()
 
-    for name in sorted(os.listdir(path)):
-        file_type = _file_type(os.path.join(path, name))
+    for file_type, name in entries:
         menu.append(MenuItem(
             file_type,
             name,
-            os.path.join(request.selector, name),
+            os.path.join(selector, name),
             request.hostname,
             request.port,
         ))
@@ -86,6 +209,9 @@ def _menu_from_directory(request, path):
     return menu
 
 
+_PAGE_SELECTOR = re.compile(r"(.*)\?page=([1-9][0-9]*)")
+
+
 @implementer(IHandler)
 class DirectoryHandler:
     """
@@ -104,15 +230,98 @@ class DirectoryHandler:
     If `filetype` is not installed then all file entries will have type `0`
     (text).
 
+    Text files are served as an
+    :class:`EncodedResponse <gopher_server.responses.EncodedResponse>`. Files
+    which aren't valid UTF-8 are served as a
+    :class:`FileResponse <gopher_server.responses.FileResponse>`, so they're
+    streamed to the client rather than read into memory. Files larger than
+    `stream_text_size` bytes aren't checked, since that would mean reading
+    the whole file first. They're streamed as text if their extension is a
+    text one such as `.txt`, and served as a `FileResponse` otherwise.
+
+    By default the file system is accessed directly from the event loop, which
+    is fine for fast local disks. On slow disks or network file systems, set
+    `io_threads` to do the file system work in a thread pool instead so that
+    one slow read doesn't hold up every other client. At most `io_threads`
+    plus `io_queue_size` requests are handed to the pool at once; any more
+    are answered straight away with a "server busy" error. `io_timeout`
+    limits the total time (in seconds) a request can spend waiting for and
+    running in the pool, and can only be used with `io_threads`. Requests
+    which time out while still queued are dropped from the pool. Large files
+    are also read in the pool as they're sent, as are files which have to be
+    copied through userspace rather than sent with `sendfile`.
+
+    For very large directory trees, generated menus can be served from a
+    pre-built :class:`MenuIndex <gopher_server.menu_index.MenuIndex>` by
+    passing it as `menu_index`. Directories which have changed since the
+    index was last updated are listed directly instead.
+
+    Generated menus can also be split into pages of `menu_page_size` entries,
+    with "Previous page" and "Next page" links at the bottom. Later pages use
+    selectors such as `dir?page=3`.
+
     """
 
-    def __init__(self, base_path: str, generate_menus=False):
+    def __init__(self, base_path: str, generate_menus=False, io_threads: int=None,
+                 io_queue_size: int=0, io_timeout: float=None, menu_index=None,
+                 menu_page_size: int=None, stream_text_size: int=1024 * 1024):
         self.base_path = os.path.abspath(base_path)
         self.generate_menus = generate_menus
-
-    async def handle(self, request: Request) -> Union[str, bytes, Menu]:
+        self.menu_index = menu_index
+        self.menu_page_size = menu_page_size
+        self.stream_text_size = stream_text_size
+        self.io_timeout = io_timeout
+        if io_threads:
+            self._executor = ThreadPoolExecutor(io_threads, thread_name_prefix="gopher_io")
+            self._executor_slots = io_threads + io_queue_size
+        elif io_timeout is not None:
+            raise ValueError("io_timeout can only be used with io_threads.")
+        else:
+            self._executor = None
+        self._executor_pending = 0
+
+    async def handle(self, request: Request) -> Union[EncodedResponse, Menu, FileResponse]:
+        if self._executor is None:
+            return self._handle(request)
+        if self.io_timeout is None:
+            return await self._run_in_executor(request)
+        return await asyncio.wait_for(self._run_in_executor(request), self.io_timeout)
+
+    async def _run_in_executor(self, request: Request) -> Union[EncodedResponse, Menu, FileResponse]:
+        if self._executor_pending >= self._executor_slots:
+            return EncodedResponse(_BUSY_RESPONSE)
+        self._executor_pending += 1
+        # Copy the context so that spans recorded in the thread are added to
+        # the request's trace.
+        concurrent_future = self._executor.submit(
+            contextvars.copy_context().run, self._handle, request,
+        )
+        # Threads can't be interrupted, so the slot is only freed when the
+        # work has actually finished or been dropped from the queue, even if
+        # the request has timed out.
+        future = asyncio.wrap_future(concurrent_future)
+        future.add_done_callback(self._executor_done)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # This only succeeds if the work hasn't started yet.
+            concurrent_future.cancel()
+            raise
+
+    def _executor_done(self, future):
+        self._executor_pending -= 1
+
+    def _handle(self, request: Request) -> Union[EncodedResponse, Menu, FileResponse]:
         selector = request.selector
 
+        page = None
+        if self.menu_page_size is not None:
+            page_match = _PAGE_SELECTOR.fullmatch(selector)
+            if page_match:
+                selector = page_match.group(1)
+                page = int(page_match.group(2))
+        menu_selector = selector
+
         # Remove leading slash because os.path.join regards it as a full path
         # otherwise.
         if selector.startswith("/"):
@@ -124,21 +333,126 @@ class DirectoryHandler:
         if not file_path.startswith(self.base_path):
             raise NotFound
 
-        if os.path.isdir(file_path):
+        with span("stat"):
+            file_stat = _stat(file_path)
+
+        if file_stat is not None and stat.S_ISDIR(file_stat.st_mode):
             if self.generate_menus:
-                return _menu_from_directory(request, file_path)
+                request.dependencies.append((file_path, file_stat.st_mtime_ns))
+                return self._generate_menu(
+                    request, menu_selector, file_path, file_stat.st_mtime_ns, page,
+                )
             else:
                 file_path = os.path.join(file_path, "index")
+                file_stat = _stat(file_path)
 
-        if not os.path.isfile(file_path):
+        if page is not None or file_stat is None or not stat.S_ISREG(file_stat.st_mode):
             raise NotFound
 
-        with open(file_path, "rb") as f:
-            data = f.read()
+        request.dependencies.append((file_path, file_stat.st_mtime_ns))
+
+        if file_stat.st_size > self.stream_text_size:
+            # Checking a large file is valid UTF-8 would mean reading all of it
+            # before sending any, so only trust the extension.
+            if _EXTENSION_TYPES.get(os.path.splitext(file_path)[1].lower()) == "0":
+                return _stream_text_file(file_path, self._executor)
+            return FileResponse(file_path, self._executor)
+
+        # Check the file is valid UTF-8 incrementally so binary files are
+        # usually rejected after the first chunk instead of being read into
+        # memory in full. Text files are kept as bytes and converted chunk by
+        # chunk, so the only full size copy is the final join.
+        decoder = getincrementaldecoder("utf-8")()
+        chunks = []
+        with span("read_file"), open(file_path, "rb") as f:
             try:
-                return data.decode("utf-8")
+                for chunk in iter(partial(f.read, CHUNK_SIZE), b""):
+                    decoder.decode(chunk)
+                    chunks.append(chunk.replace(b"\n", b"\r\n"))
+                decoder.decode(b"", final=True)
             except UnicodeDecodeError:
-                return data
+                return FileResponse(file_path, self._executor)
+        if not chunks or not chunks[-1].endswith(b"\r\n"):
+            chunks.append(b"\r\n")
+        chunks.append(b".\r\n")
+        return EncodedResponse(b"".join(chunks))
+
+    def _generate_menu(self, request: Request, selector: str, path: str, mtime_ns: int,
+                       page: int=None) -> Menu:
+        start, stop = 0, None
+        if self.menu_page_size is not None:
+            page = page or 1
+            start = (page - 1) * self.menu_page_size
+            # Fetch one extra entry to find out if there's a next page.
+            stop = start + self.menu_page_size + 1
+
+        entries = None
+        if self.menu_index is not None:
+            entries = self.menu_index.get(os.path.relpath(path, self.base_path), mtime_ns)
+            if entries is not None:
+                entries = entries[start:stop]
+        if entries is None:
+            entries = _directory_entries(path, start, stop)
+
+        if page is None:
+            return _menu_from_entries(request, selector, entries)
+
+        if page > 1 and not entries:
+            raise NotFound
+
+        menu = _menu_from_entries(request, selector, entries[:self.menu_page_size])
+        if page > 1:
+            menu.append(MenuItem(
+                "1", "Previous page", "%s?page=%s" % (selector, page - 1),
+                request.hostname, request.port,
+            ))
+        if len(entries) > self.menu_page_size:
+            menu.append(MenuItem(
+                "1", "Next page", "%s?page=%s" % (selector, page + 1),
+                request.hostname, request.port,
+            ))
+        return menu
+
+
+_SPECIAL_CHARACTERS = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+
+def _literal_prefix(pattern: str) -> str:
+    """Returns the part of the pattern which any match must start with."""
+
+    # Alternation at the top level means there's no common prefix.
+    if "|" in pattern:
+        return ""
+
+    match = _SPECIAL_CHARACTERS.search(pattern)
+    prefix = pattern[:match.start()]
+    # The last character is optional if it's followed by a quantifier.
+    if match.group() in "*?{":
+        prefix = prefix[:-1]
+    return prefix
+
+
+def _prefix_matches(trie: dict, selector: str) -> list:
+    """
+    Returns the routes in the trie whose prefix matches the selector, in
+    registration order.
+    """
+
+    node = trie
+    routes = list(node.get(None, ()))
+    sort = False
+    for character in selector:
+        node = node.get(character)
+        if node is None:
+            break
+        if None in node:
+            # Routes from more than one node have to be merged back in order.
+            if routes:
+                sort = True
+            routes.extend(node[None])
+    if sort:
+        routes.sort(key=lambda route: route[0])
+    return routes
 
 
 @implementer(IHandler)
@@ -165,30 +479,159 @@ class PatternHandler:
        def hello(request, name):
            return "hello %s" % name
 
+    View functions can also be async generators, in which case the response
+    is streamed to the client as it's generated.
+
+    Synchronous views run on the event loop, so a view which does a lot of
+    work holds up every other client while it runs. Such views can be run in
+    a pool instead by passing `executor="thread"` (for views which wait on
+    I/O or release the GIL) or `executor="process"` (for CPU-bound views) to
+    :func:`register <PatternHandler.register>`. The pools are created the
+    first time they're used, with `threads` and `processes` workers (by
+    default, the :mod:`concurrent.futures` defaults).
+
+    Views run in a process pool must be defined at module level so they can
+    be pickled, and receive a copy of the request. The pool's processes are
+    started with the `forkserver` method where it's available (otherwise
+    `spawn`), so they don't inherit the server's listening sockets or signal
+    handlers, and import the view's module afresh. Their responses are
+    encoded in the worker process, and any
+    :attr:`Request.dependencies <gopher_server.handlers.Request>` they add
+    are copied back. Call :meth:`close` to shut the pools down;
+    :func:`run_workers <gopher_server.workers.run_workers>` does this when a
+    worker exits.
+
     .. note:: Patterns are compared in the order in which they were
               registered, so if the selector matches multiple patterns then
               the one which was registered first will "win".
     """
 
-    def __init__(self):
+    def __init__(self, threads: int=None, processes: int=None):
         self.patterns = []
+        self.threads = threads
+        self.processes = processes
+        self._executors = {}
+        # Patterns without any special characters are looked up in a dict.
+        # The rest are stored in a trie of their literal prefixes, so only the
+        # patterns whose prefix matches the selector need to be tried.
+        self._static_routes = {}
+        self._dynamic_routes = {}
 
     async def handle(self, request: Request) -> Union[str, bytes, Menu]:
-        for pattern, func in self.patterns:
-            match = pattern.match(request.selector)
+        selector = request.selector
+
+        static_route = self._static_routes.get(selector)
+        # Only patterns registered before a matching static pattern can win.
+        limit = static_route[0] if static_route else len(self.patterns)
+
+        for index, pattern, func, is_coroutine in _prefix_matches(self._dynamic_routes, selector):
+            if index >= limit:
+                break
+            match = pattern.match(selector)
             if match:
-                if iscoroutinefunction(func):
+                # Strip the anchors added by register().
+                request.pattern = pattern.pattern[1:-1]
+                if is_coroutine:
                     return await func(request, **match.groupdict())
                 return func(request, **match.groupdict())
+
+        if static_route:
+            index, func, is_coroutine = static_route
+            request.pattern = selector
+            if is_coroutine:
+                return await func(request)
+            return func(request)
+
         raise NotFound
 
-    def register(self, pattern: str):
-        """Decorator to register a view function."""
+    def register(self, pattern: str, executor: str=None, timeout: float=None):
+        """
+        Decorator to register a view function.
+
+        `executor` can be `"thread"` or `"process"` to run a synchronous view
+        in a pool. `timeout` then limits the time (in seconds) the view can
+        spend waiting for and running in the pool. Views which time out are
+        answered with an error, but a view which has already started can't be
+        interrupted, so it keeps its worker until it finishes.
+        """
 
-        pattern = re.compile("^%s$" % pattern)
+        compiled_pattern = re.compile("^%s$" % pattern)
+        if executor not in (None, "thread", "process"):
+            raise ValueError("Unknown executor %r." % executor)
 
         def f(func):
-            self.patterns.append((pattern, func))
+            index = len(self.patterns)
+            self.patterns.append((compiled_pattern, func))
+            view = func
+            if executor is not None:
+                if iscoroutinefunction(func) or isasyncgenfunction(func):
+                    raise ValueError("Only synchronous views can be run in an executor.")
+                view = partial(self._run_in_executor, executor, timeout, func)
+            is_coroutine = executor is not None or iscoroutinefunction(func)
+            if _SPECIAL_CHARACTERS.search(pattern) is None:
+                self._static_routes.setdefault(pattern, (index, view, is_coroutine))
+            else:
+                node = self._dynamic_routes
+                for character in _literal_prefix(pattern):
+                    node = node.setdefault(character, {})
+                node.setdefault(None, []).append((index, compiled_pattern, view, is_coroutine))
             return func
 
         return f
+
+    def close(self):
+        """
+        Shuts down the thread and process pools, waiting for views which are
+        already running to finish.
+        """
+        executors, self._executors = self._executors, {}
+        for pool in executors.values():
+            pool.shutdown()
+
+    async def _run_in_executor(self, executor: str, timeout: float, func, request: Request,
+                               **kwargs):
+        pool = self._executors.get(executor)
+        if pool is None:
+            # Created on first use, so worker processes forked by
+            # run_workers() don't share a pool.
+            if executor == "process":
+                # Imported here because multiprocessing is slow to import.
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context(
+                    "forkserver" if "forkserver" in methods else "spawn",
+                )
+                pool = ProcessPoolExecutor(self.processes, mp_context=context)
+            else:
+                pool = ThreadPoolExecutor(self.threads, thread_name_prefix="gopher_view")
+            self._executors[executor] = pool
+
+        loop = asyncio.get_running_loop()
+        if executor == "process":
+            future = loop.run_in_executor(pool, _call_view, func, request, kwargs)
+        else:
+            # Copy the context so that spans recorded in the thread are added
+            # to the request's trace.
+            future = loop.run_in_executor(
+                pool, contextvars.copy_context().run, partial(func, request, **kwargs),
+            )
+
+        with span("view_executor"):
+            response = await asyncio.wait_for(future, timeout)
+        if executor == "process":
+            response, dependencies = response
+            request.dependencies.extend(dependencies)
+        return response
+
+
+def _call_view(func, request: Request, kwargs: dict):
+    """
+    Runs a view in a worker process, and returns its encoded response and the
+    dependencies it added to the request.
+    """
+    response = func(request, **kwargs)
+    data = encode_response(response)
+    if data is not None:
+        response = EncodedResponse(data)
+    return response, request.dependencies
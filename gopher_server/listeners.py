@@ -1,47 +1,632 @@
 import asyncio
+import re
 import ssl
+import weakref
 
-try:
-    from aioquic.asyncio import serve
-    from aioquic.quic.configuration import QuicConfiguration
-    from cryptography import x509
-    from cryptography.hazmat.backends import default_backend
-    from cryptography.hazmat.primitives import serialization
-    QUIC_ENABLED = True
-except ImportError:
-    QUIC_ENABLED = False
+from collections import OrderedDict
+from collections.abc import AsyncIterable
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import partial
+from importlib.util import find_spec
+from logging import getLogger
+from time import monotonic, perf_counter
+from typing import Dict, Optional
+
+# The QUIC dependencies take a long time to import, so they're only imported
+# when quic_listener() is called.
+QUIC_ENABLED = find_spec("aioquic") is not None and find_spec("cryptography") is not None
 
 from gopher_server.application import Application
+from gopher_server.responses import CHUNK_SIZE, FileResponse, _aclose, _read_chunks
+from gopher_server.tracing import span
 
+log = getLogger(__name__)
 
-async def tcp_listener(application: Application, hostname: str, host: str, port: int):
-    """Basic unencrypted TCP listener."""
+_BUSY_RESPONSE = b"3Server busy.\t\terror.host\t0\r\n.\r\n"
+_SELECTOR_TOO_LONG_RESPONSE = b"3Selector too long.\t\terror.host\t0\r\n.\r\n"
+_RATE_LIMITED_RESPONSE = b"3Too many requests.\t\terror.host\t0\r\n.\r\n"
 
-    async def handle_connection(reader, writer):
-        data = await reader.readline()
-        writer.write(await application.dispatch(hostname, port, data))
+# How much unacknowledged data a QUIC stream can have before writing waits,
+# and how often (in seconds) to check whether it has gone down.
+_QUIC_HIGH_WATER = 4 * CHUNK_SIZE
+_QUIC_DRAIN_INTERVAL = 0.005
+
+
+@dataclass
+class ConnectionLimits:
+    """
+    Limits to protect a TCP listener from slow, idle or excessive clients.
+
+    * `read_timeout` is the number of seconds a client has to send its
+      selector line after connecting.
+    * `write_timeout` is the number of seconds allowed for sending the whole
+      response.
+    * `max_selector_size` is the maximum length of the selector line in
+      bytes. Longer selectors are rejected with a type `3` error.
+    * `max_connections` is the maximum number of connections open at once,
+      and `max_connections_per_ip` is the maximum for each client IP
+      address. Connections over either limit are sent a "server busy" error
+      and closed immediately.
+    * `requests_per_second` and `request_burst` rate limit the requests from
+      each client IP address using a token bucket: each IP can make
+      `request_burst` requests at once, and gets back `requests_per_second`
+      of them every second. Requests over the limit are sent a "too many
+      requests" error without being dispatched.
+    * `route_costs` maps selector patterns (matched in the same way as
+      :class:`PatternHandler <gopher_server.handlers.PatternHandler>`
+      patterns) to the number of tokens their requests use, so expensive
+      views can be limited more strictly. Other requests cost 1. The
+      patterns are tried in turn, so keep this to a handful of routes.
+      `request_burst` defaults to the larger of `requests_per_second` and
+      the largest cost, and can't be set lower than the largest cost.
+    * `max_in_flight` is the maximum number of requests being dispatched or
+      sent at once. Requests over the limit are shed with a "server busy"
+      error straight away, rather than queueing behind the others.
+    * `max_tracked_ips` bounds the memory used for rate limiting. The least
+      recently seen IP addresses are forgotten first, and start again with a
+      full bucket if they come back.
+
+    Any of these except `max_tracked_ips` can be `None` for no limit, which
+    is the default. The limits are shared by every listener given the same
+    `ConnectionLimits` object, so passing one object to several listeners
+    limits their clients in total rather than on each listener. For example:
+
+    .. code-block::
+
+       limits = ConnectionLimits(
+           read_timeout=10, write_timeout=300, max_selector_size=1024,
+           max_connections=1000, max_connections_per_ip=20,
+           requests_per_second=5, request_burst=20, max_in_flight=200,
+           route_costs={"search/.*": 5},
+       )
+       loop.create_task(tcp_listener(
+           application, "localhost", "0.0.0.0", 7000, limits=limits,
+       ))
+    """
+
+    read_timeout: float = None
+    write_timeout: float = None
+    max_selector_size: int = None
+    max_connections: int = None
+    max_connections_per_ip: int = None
+    requests_per_second: float = None
+    request_burst: float = None
+    route_costs: Dict[str, float] = None
+    max_in_flight: int = None
+    max_tracked_ips: int = 65536
+
+
+class _ConnectionCounter:
+    """
+    Counts open connections, in total and per IP address, and requests in
+    flight, and keeps the token buckets for rate limiting.
+    """
+
+    def __init__(self, limits: ConnectionLimits):
+        self.limits = limits
+        self.connections = 0
+        self.connections_per_ip = {}
+        self.in_flight = 0
+        # IP address -> [tokens, time of last update], least recently seen
+        # first.
+        self.buckets = OrderedDict()
+        self.route_costs = [
+            (re.compile(pattern.encode("utf-8")), cost)
+            for pattern, cost in (limits.route_costs or {}).items()
+        ]
+        max_cost = max([1] + [cost for _, cost in self.route_costs])
+        self.burst = limits.request_burst
+        if self.burst is None and limits.requests_per_second is not None:
+            self.burst = max(max_cost, limits.requests_per_second)
+        elif self.burst is not None and self.burst < max_cost:
+            # The bucket could never hold enough tokens for these requests.
+            raise ValueError(
+                "request_burst must be at least the largest route cost (%s)." % max_cost,
+            )
+
+    def acquire(self, ip: str) -> bool:
+        """Counts a new connection, or returns `False` if it's over a limit."""
+        ip_connections = self.connections_per_ip.get(ip, 0)
+        if (
+            (self.limits.max_connections is not None
+             and self.connections >= self.limits.max_connections)
+            or (self.limits.max_connections_per_ip is not None
+                and ip_connections >= self.limits.max_connections_per_ip)
+        ):
+            return False
+        self.connections += 1
+        self.connections_per_ip[ip] = ip_connections + 1
+        return True
+
+    def release(self, ip: str):
+        self.connections -= 1
+        self.connections_per_ip[ip] -= 1
+        if not self.connections_per_ip[ip]:
+            del self.connections_per_ip[ip]
+
+    def admit(self, ip: str, selector: bytes) -> Optional[bytes]:
+        """
+        Counts a request as in flight, or returns the error response to send
+        if it's over a limit. Admitted requests must be finished with
+        :meth:`finish`.
+        """
+
+        if self.limits.max_in_flight is not None and self.in_flight >= self.limits.max_in_flight:
+            return _BUSY_RESPONSE
+
+        rate = self.limits.requests_per_second
+        if rate is not None:
+            cost = 1
+            if self.route_costs:
+                stripped_selector = selector.strip()
+                for pattern, route_cost in self.route_costs:
+                    if pattern.fullmatch(stripped_selector):
+                        cost = route_cost
+                        break
+
+            now = monotonic()
+            bucket = self.buckets.get(ip)
+            if bucket is None:
+                bucket = self.buckets[ip] = [self.burst, now]
+                if len(self.buckets) > self.limits.max_tracked_ips:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(ip)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] < cost:
+                return _RATE_LIMITED_RESPONSE
+            bucket[0] -= cost
+
+        self.in_flight += 1
+        return None
+
+    def finish(self):
+        self.in_flight -= 1
+
+
+def _shared_counter(limits: ConnectionLimits) -> _ConnectionCounter:
+    """Returns the counter for `limits`, creating it the first time."""
+    counter = getattr(limits, "_counter", None)
+    if counter is None:
+        counter = limits._counter = _ConnectionCounter(limits)
+    return counter
+
+
+def _peer_ip(transport) -> str:
+    peername = transport.get_extra_info("peername")
+    return peername[0] if isinstance(peername, tuple) else peername
+
+
+async def _write_response(writer, response, sendfile: bool=True) -> int:
+    """
+    Writes a response from :meth:`Application.dispatch
+    <gopher_server.application.Application.dispatch>` and closes the stream.
+    Returns the number of bytes written.
+
+    File responses are sent with `sendfile` if possible, otherwise they're
+    copied in fixed size chunks. Streamed responses are written as they're
+    produced. Either way, the writer's `drain()` is awaited after each chunk,
+    so memory use only stays independent of the response size if `drain()`
+    actually waits for the write buffer to empty. The stream writers of the
+    TCP listeners and :class:`_GopherProtocol` do, and QUIC streams are
+    wrapped in :class:`_QuicStreamWriter` to do the same.
+    """
+
+    written = 0
+    if isinstance(response, FileResponse):
+        if sendfile:
+            with open(response.path, "rb") as f:
+                await writer.drain()
+                try:
+                    written = await asyncio.get_running_loop().sendfile(writer.transport, f)
+                except NotImplementedError:
+                    # Some event loops (such as uvloop) don't have sendfile.
+                    sendfile = False
+        if not sendfile:
+            chunks = _read_chunks(response.path, response.executor)
+            try:
+                async for chunk in chunks:
+                    writer.write(chunk)
+                    written += len(chunk)
+                    await writer.drain()
+            finally:
+                await chunks.aclose()
+    elif isinstance(response, AsyncIterable):
+        # Close the stream straight away if the client goes or the write
+        # times out, rather than leaving it to the garbage collector.
+        try:
+            async for chunk in response:
+                writer.write(chunk)
+                written += len(chunk)
+                await writer.drain()
+        finally:
+            await _aclose(response)
+    else:
+        writer.write(response)
+        written = len(response)
+    # TLS transports can't half-close the connection.
+    if writer.can_write_eof():
         writer.write_eof()
+    else:
+        writer.close()
+    return written
 
-    await asyncio.start_server(handle_connection, host, port)
 
+def _connection_handler(application: Application, hostname: str, port: int,
+                        limits: ConnectionLimits, sendfile: bool, name: str):
+    """Creates the connection callback for the stream based listeners."""
 
-async def tcp_tls_listener(application: Application, hostname: str, host: str, port: int,
-                           certificate_path: str, private_key_path: str, password: str=None):
-    """Gopher-over-TLS listener."""
-    ssl_context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLS)
-    ssl_context.load_cert_chain(certificate_path, private_key_path, password)
+    counter = _shared_counter(limits)
+    metrics = getattr(application, "metrics", None)
+    tracer = getattr(application, "tracer", None)
 
     async def handle_connection(reader, writer):
-        data = await reader.readline()
-        writer.write(await application.dispatch(hostname, port, data))
-        writer.write_eof()
+        ip = _peer_ip(writer.transport)
+        if not counter.acquire(ip):
+            writer.write(_BUSY_RESPONSE)
+            writer.close()
+            return
+
+        if metrics is not None:
+            metrics.connection_opened(name)
+        try:
+            try:
+                with span("read"):
+                    data = await asyncio.wait_for(reader.readline(), limits.read_timeout)
+            except asyncio.TimeoutError:
+                writer.transport.abort()
+                return
+            except ValueError:
+                # The selector line is longer than the stream's limit.
+                writer.write(_SELECTOR_TOO_LONG_RESPONSE)
+                writer.close()
+                return
+
+            rejection = counter.admit(ip, data)
+            if rejection is not None:
+                writer.write(rejection)
+                writer.close()
+                return
+
+            try:
+                response = await application.dispatch(hostname, port, data)
+                with span("write"):
+                    written = await asyncio.wait_for(
+                        _write_response(writer, response, sendfile=sendfile),
+                        limits.write_timeout,
+                    )
+            except asyncio.TimeoutError:
+                writer.transport.abort()
+            except ConnectionError:
+                # The client disconnected before the response was sent.
+                writer.transport.abort()
+            else:
+                if metrics is not None:
+                    metrics.bytes_sent[name] += written
+            finally:
+                counter.finish()
+        finally:
+            counter.release(ip)
+            if metrics is not None:
+                metrics.connection_closed(name)
+
+    if tracer is None:
+        return handle_connection
+
+    async def handle_traced_connection(reader, writer):
+        with tracer.trace():
+            await handle_connection(reader, writer)
+
+    return handle_traced_connection
+
+
+def _stream_limit(limits: ConnectionLimits) -> int:
+    # Use asyncio's default limit if there's no maximum selector size.
+    return limits.max_selector_size or 2 ** 16
+
+
+async def tcp_listener(application: Application, hostname: str, host: str, port: int,
+                       reuse_port: bool=False, limits: ConnectionLimits=None):
+    """
+    Basic unencrypted TCP listener.
+
+    Returns the :class:`asyncio.Server` so that it can be closed later.
+    Setting `reuse_port` to `True` sets `SO_REUSEPORT` on the socket, so that
+    several worker processes can listen on the same port.
+
+    Timeouts and connection limits can be set by passing a
+    :class:`ConnectionLimits` object as `limits`.
+    """
+
+    limits = limits or ConnectionLimits()
+
+    return await asyncio.start_server(
+        _connection_handler(application, hostname, port, limits, sendfile=True, name="tcp"),
+        host, port, reuse_port=reuse_port, limit=_stream_limit(limits),
+    )
+
+
+class _GopherProtocol(asyncio.Protocol):
+    """
+    Protocol for :func:`tcp_protocol_listener`.
+
+    This also provides the parts of the :class:`asyncio.StreamWriter`
+    interface which :func:`_write_response` uses.
+    """
+
+    def __init__(self, application: Application, hostname: str, port: int,
+                 limits: ConnectionLimits, counter: _ConnectionCounter):
+        self.application = application
+        self.hostname = hostname
+        self.port = port
+        self.limits = limits
+        self.counter = counter
+        self.metrics = getattr(application, "metrics", None)
+        self.tracer = getattr(application, "tracer", None)
+        self.transport = None
+        self._ip = None
+        self._buffer = bytearray()
+        self._task = None
+        self._read_timer = None
+        self._paused = False
+        self._drain_waiter = None
+        self._connection_lost = False
+        self._read_start = None
+        self._read_time = 0.0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self._read_start = perf_counter()
+        ip = _peer_ip(transport)
+        if not self.counter.acquire(ip):
+            self._reject(_BUSY_RESPONSE)
+            return
+        self._ip = ip
+        if self.metrics is not None:
+            self.metrics.connection_opened("tcp_protocol")
+        if self.limits.read_timeout is not None:
+            self._read_timer = asyncio.get_running_loop().call_later(
+                self.limits.read_timeout, transport.abort,
+            )
+
+    def data_received(self, data: bytes):
+        if self._task is not None or self._buffer is None:
+            return
+        self._buffer += data
+        end = self._buffer.find(b"\n")
+        max_size = _stream_limit(self.limits)
+        if end > max_size or (end == -1 and len(self._buffer) > max_size):
+            self._reject(_SELECTOR_TOO_LONG_RESPONSE)
+        elif end != -1:
+            self._dispatch(bytes(self._buffer[:end + 1]))
+
+    def eof_received(self) -> bool:
+        if self._buffer is None:
+            return False
+        # Like readline(), treat EOF as the end of the selector.
+        if self._task is None:
+            self._dispatch(bytes(self._buffer))
+        # Keep the transport open to send the response.
+        return True
+
+    def connection_lost(self, exc):
+        self._connection_lost = True
+        self._wake_drain_waiter(exc)
+        if self._read_timer is not None:
+            self._read_timer.cancel()
+        if self._ip is not None:
+            self.counter.release(self._ip)
+            if self.metrics is not None:
+                self.metrics.connection_closed("tcp_protocol")
+
+    def pause_writing(self):
+        self._paused = True
+
+    def resume_writing(self):
+        self._paused = False
+        self._wake_drain_waiter(None)
+
+    def write(self, data: bytes):
+        self.transport.write(data)
+
+    def can_write_eof(self) -> bool:
+        return self.transport.can_write_eof()
+
+    def write_eof(self):
+        self.transport.write_eof()
+
+    def close(self):
+        self.transport.close()
+
+    async def drain(self):
+        if self._connection_lost:
+            raise ConnectionResetError("Connection lost")
+        if not self._paused:
+            return
+        self._drain_waiter = asyncio.get_running_loop().create_future()
+        await self._drain_waiter
+
+    def _wake_drain_waiter(self, exc):
+        waiter, self._drain_waiter = self._drain_waiter, None
+        if waiter is None or waiter.done():
+            return
+        if exc is None:
+            waiter.set_result(None)
+        else:
+            waiter.set_exception(exc)
+
+    def _reject(self, response: bytes):
+        self._buffer = None
+        self.transport.write(response)
+        self.transport.close()
+
+    def _dispatch(self, selector: bytes):
+        self._buffer = None
+        self._read_time = perf_counter() - self._read_start
+        if self._read_timer is not None:
+            self._read_timer.cancel()
+        self._task = asyncio.get_running_loop().create_task(self._respond(selector))
+
+    async def _respond(self, selector: bytes):
+        if self.tracer is None:
+            await self._respond_untraced(selector)
+            return
+        with self.tracer.trace() as trace:
+            # The selector arrived before the task started, so the time
+            # spent reading it is added by hand.
+            trace.start -= self._read_time
+            trace.add("read", self._read_time)
+            await self._respond_untraced(selector)
 
-    await asyncio.start_server(handle_connection, host, port, ssl=ssl_context)
+    async def _respond_untraced(self, selector: bytes):
+        rejection = self.counter.admit(self._ip, selector)
+        if rejection is not None:
+            self._reject(rejection)
+            return
+
+        try:
+            response = await self.application.dispatch(self.hostname, self.port, selector)
+            with span("write"):
+                written = await asyncio.wait_for(
+                    _write_response(self, response), self.limits.write_timeout,
+                )
+            if self.metrics is not None:
+                self.metrics.bytes_sent["tcp_protocol"] += written
+        except asyncio.TimeoutError:
+            self.transport.abort()
+        except ConnectionError:
+            # The client disconnected before the response was sent.
+            self.transport.abort()
+        finally:
+            self.counter.finish()
+            self.transport.close()
+
+
+async def tcp_protocol_listener(application: Application, hostname: str, host: str, port: int,
+                                reuse_port: bool=False, limits: ConnectionLimits=None):
+    """
+    Unencrypted TCP listener built directly on :class:`asyncio.Protocol`.
+
+    This behaves the same as :func:`tcp_listener`, but parses the selector
+    straight out of the received data instead of creating stream objects for
+    each connection, which makes it faster for high volumes of small
+    requests. It works particularly well with `uvloop
+    <https://uvloop.readthedocs.io/>`_, which can be installed using the
+    `uvloop` extras::
+
+        pip install gopher_server[uvloop]
+
+    Takes the same `reuse_port` and `limits` arguments as :func:`tcp_listener`.
+    """
+
+    limits = limits or ConnectionLimits()
+    counter = _shared_counter(limits)
+
+    return await asyncio.get_running_loop().create_server(
+        partial(_GopherProtocol, application, hostname, port, limits, counter),
+        host, port, reuse_port=reuse_port,
+    )
+
+
+# Certificate arguments for each context created by tls_context(), so that
+# reload_tls_certificates() can find them.
+_tls_certificates = weakref.WeakKeyDictionary()
+
+
+def tls_context(certificate_path: str, private_key_path: str, password: str=None,
+                ciphers: str=None, ecdh_curve: str=None,
+                session_tickets: bool=True) -> ssl.SSLContext:
+    """
+    Creates the server :class:`ssl.SSLContext` used by :func:`tcp_tls_listener`.
+
+    Clients which reconnect can resume their previous session, which skips
+    the expensive key exchange and certificate verification. By default this
+    uses session tickets, which are encrypted with a key held in memory by the
+    context. Python's `ssl` module doesn't allow setting this key, so it's
+    only rotated when a new context is created, for example when
+    :func:`run_workers <gopher_server.workers.run_workers>` restarts its
+    workers. Setting `session_tickets` to `False` uses OpenSSL's server side
+    session cache instead, so there's no long lived key to worry about.
+
+    `ciphers` sets the TLS 1.2 cipher preferences as an OpenSSL cipher string,
+    and makes the server's order take priority over the client's. For
+    throughput, prefer ciphers with hardware support on the server such as
+    `ECDHE+AESGCM`. `ecdh_curve` sets the curve used for key exchange (for
+    example `prime256v1`). Leaving them unset uses OpenSSL's defaults, which
+    are a good choice in most cases.
+    """
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.options |= ssl.OP_NO_COMPRESSION
+    if ciphers is not None:
+        context.set_ciphers(ciphers)
+        context.options |= ssl.OP_CIPHER_SERVER_PREFERENCE
+    if ecdh_curve is not None:
+        context.set_ecdh_curve(ecdh_curve)
+    if not session_tickets:
+        context.options |= ssl.OP_NO_TICKET
+    context.load_cert_chain(certificate_path, private_key_path, password)
+    _tls_certificates[context] = (certificate_path, private_key_path, password)
+    return context
+
+
+def reload_tls_certificates():
+    """
+    Loads the certificate and private key files again for every context
+    created by :func:`tls_context`, including those used by running
+    :func:`tcp_tls_listener` listeners. New connections use the new
+    certificate, and open connections aren't affected.
+
+    If the files can't be loaded, the error is logged and the previous
+    certificate is kept. The main script calls this on `SIGHUP`.
+    """
+
+    for context, certificate in list(_tls_certificates.items()):
+        try:
+            # Check the files load before touching the live context, so it
+            # isn't left with a certificate that doesn't match its key.
+            ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER).load_cert_chain(*certificate)
+            context.load_cert_chain(*certificate)
+        except (OSError, ssl.SSLError) as e:
+            log.error("Couldn't reload certificate %s:", certificate[0], exc_info=e)
+        else:
+            log.info("Reloaded certificate %s.", certificate[0])
+
+
+async def tcp_tls_listener(application: Application, hostname: str, host: str, port: int,
+                           certificate_path: str, private_key_path: str, password: str=None,
+                           reuse_port: bool=False, limits: ConnectionLimits=None,
+                           ciphers: str=None, ecdh_curve: str=None, session_tickets: bool=True):
+    """
+    Gopher-over-TLS listener.
+
+    Takes the same `reuse_port` and `limits` arguments as :func:`tcp_listener`.
+    The `ciphers`, `ecdh_curve` and `session_tickets` arguments are passed to
+    :func:`tls_context`. The certificate can be replaced without restarting
+    the listener using :func:`reload_tls_certificates`.
+    """
+    ssl_context = tls_context(
+        certificate_path, private_key_path, password,
+        ciphers=ciphers, ecdh_curve=ecdh_curve, session_tickets=session_tickets,
+    )
+
+    limits = limits or ConnectionLimits()
+
+    return await asyncio.start_server(
+        _connection_handler(application, hostname, port, limits, sendfile=False, name="tls"),
+        host, port, ssl=ssl_context, reuse_port=reuse_port, limit=_stream_limit(limits),
+    )
 
 
 async def quic_listener(application: Application, hostname: str, host: str, port: int,
                         certificate_path: str, private_key_path: str, password: str=None,
-                        quic_configuration_args: dict=None):
+                        quic_configuration_args: dict=None, idle_timeout: float=None,
+                        session_resumption: bool=False, max_streams: int=None,
+                        max_streams_per_connection: int=None, read_timeout: float=None,
+                        max_selector_size: int=None, limits: ConnectionLimits=None):
     """
     Gopher-over-QUIC listener.
 
@@ -60,7 +645,32 @@ async def quic_listener(application: Application, hostname: str, host: str, port
     TCP connection due to the use of QUIC streams. Gopher-over-TCP only supports
     one request per connection, however `quic_listener` supports one request
     per stream, allowing clients to re-use the connection by creating a new
-    stream for each request.
+    stream for each request. Each stream is dispatched as soon as its
+    selector line has arrived.
+
+    `idle_timeout` sets how many seconds an idle connection is kept open for,
+    so clients can keep re-using it. Setting `session_resumption` to `True`
+    keeps session tickets in memory so that returning clients can resume
+    their session, including sending their request as 0-RTT data.
+
+    `max_streams` limits the number of requests handled at once across all
+    connections, and `max_streams_per_connection` limits them for each
+    connection. Streams over either limit are immediately sent a "server
+    busy" error.
+
+    A stream counts towards these limits from when it's opened, so set
+    `read_timeout` to close streams which don't send their selector line
+    within that many seconds. Otherwise a client which opens streams and
+    never finishes the selector can hold every slot. `max_selector_size` is
+    the maximum length of the selector line in bytes, as with
+    :class:`ConnectionLimits`. Selector lines are never allowed to be longer
+    than 64 KiB.
+
+    Passing a :class:`ConnectionLimits` object as `limits` applies its rate
+    limits (`requests_per_second`, `request_burst` and `route_costs`) and
+    `max_in_flight` to each stream, shared with any TCP listeners using the
+    same object. Its other limits are about TCP connections, and are
+    covered by the arguments above instead.
     """
 
     if not QUIC_ENABLED:
@@ -69,6 +679,12 @@ async def quic_listener(application: Application, hostname: str, host: str, port
             "Please install the [quic] extras."
         )
 
+    from aioquic.asyncio import QuicConnectionProtocol, serve
+    from aioquic.quic.configuration import QuicConfiguration
+    from cryptography import x509
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+
     with open(certificate_path, "rb") as f:
         certificate = x509.load_pem_x509_certificate(
             f.read(), backend=default_backend(),
@@ -78,18 +694,186 @@ async def quic_listener(application: Application, hostname: str, host: str, port
             f.read(), password=password, backend=default_backend(),
         )
 
+    quic_configuration_args = dict(quic_configuration_args or {})
+    if idle_timeout is not None:
+        quic_configuration_args["idle_timeout"] = idle_timeout
+
     configuration = QuicConfiguration(
         is_client=False,
         certificate=certificate,
         private_key=private_key,
-        **quic_configuration_args or {},
+        **quic_configuration_args,
     )
 
+    serve_args = {}
+    if session_resumption:
+        session_ticket_store = _SessionTicketStore()
+        serve_args["session_ticket_fetcher"] = session_ticket_store.pop
+        serve_args["session_ticket_handler"] = session_ticket_store.add
+
+    class GopherQuicProtocol(QuicConnectionProtocol):
+        # aioquic doesn't expose the client's address, so keep track of where
+        # its packets come from.
+        peer_ip = None
+
+        def datagram_received(self, data, addr):
+            self.peer_ip = addr[0]
+            super().datagram_received(data, addr)
+
+    counter = _shared_counter(limits or ConnectionLimits())
+    active_streams = 0
+    connection_streams = {}
+    metrics = getattr(application, "metrics", None)
+    tracer = getattr(application, "tracer", None)
+
     def stream_handler(reader, writer):
-        async def handle_stream():
-            data = await reader.read()
-            writer.write(await application.dispatch(hostname, port, data))
+        nonlocal active_streams
+
+        # The stream's transport holds a reference to the connection.
+        connection = writer.transport.protocol
+
+        if (
+            (max_streams is not None and active_streams >= max_streams)
+            or (
+                max_streams_per_connection is not None
+                and connection_streams.get(connection, 0) >= max_streams_per_connection
+            )
+        ):
+            writer.write(_BUSY_RESPONSE)
             writer.write_eof()
+            return
+
+        active_streams += 1
+        connection_streams[connection] = connection_streams.get(connection, 0) + 1
+        if metrics is not None:
+            metrics.connection_opened("quic")
+
+        async def handle_stream():
+            nonlocal active_streams
+            try:
+                with tracer.trace() if tracer is not None else nullcontext():
+                    try:
+                        with span("read"):
+                            data = await asyncio.wait_for(reader.readline(), read_timeout)
+                    except asyncio.TimeoutError:
+                        writer.close()
+                        return
+                    except ValueError:
+                        # The selector line is longer than the stream's limit.
+                        data = None
+                    if data is None or (
+                        max_selector_size is not None
+                        and len(data) - data.endswith(b"\n") > max_selector_size
+                    ):
+                        writer.write(_SELECTOR_TOO_LONG_RESPONSE)
+                        writer.write_eof()
+                        return
+
+                    rejection = counter.admit(connection.peer_ip, data)
+                    if rejection is not None:
+                        writer.write(rejection)
+                        writer.write_eof()
+                        return
+                    try:
+                        response = await application.dispatch(hostname, port, data)
+                        with span("write"):
+                            written = await _write_response(
+                                _QuicStreamWriter(writer), response, sendfile=False,
+                            )
+                    finally:
+                        counter.finish()
+                if metrics is not None:
+                    metrics.bytes_sent["quic"] += written
+            except ConnectionError:
+                # The connection was closed while the response was being sent.
+                pass
+            except Exception as e:
+                log.error("Caught exception:", exc_info=e)
+            finally:
+                active_streams -= 1
+                if metrics is not None:
+                    metrics.connection_closed("quic")
+                connection_streams[connection] -= 1
+                if not connection_streams[connection]:
+                    del connection_streams[connection]
+
         asyncio.ensure_future(handle_stream())
 
-    await serve(host, port, configuration=configuration, stream_handler=stream_handler)
+    return await serve(
+        host, port, configuration=configuration, create_protocol=GopherQuicProtocol,
+        stream_handler=stream_handler, **serve_args,
+    )
+
+
+class _QuicStreamWriter:
+    """
+    Wraps an aioquic stream writer so that :meth:`drain` waits for the data to
+    be sent.
+
+    aioquic's stream transports never pause writing, so
+    :meth:`asyncio.StreamWriter.drain` returns straight away and a large
+    response would be copied into the stream's send buffer in one go, without
+    yielding to the event loop. Instead, this waits while the stream has more
+    than `_QUIC_HIGH_WATER` bytes which haven't been acknowledged yet. aioquic
+    has no public API for this, so it looks at the stream's sender directly,
+    and falls back to the stream writer's own :meth:`drain` if the version of
+    aioquic doesn't have the attributes it uses.
+    """
+
+    __slots__ = ("writer", "transport")
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.transport = writer.transport
+
+    def write(self, data: bytes):
+        self.writer.write(data)
+
+    def can_write_eof(self) -> bool:
+        return self.writer.can_write_eof()
+
+    def write_eof(self):
+        self.writer.write_eof()
+
+    def close(self):
+        self.writer.close()
+
+    async def drain(self):
+        closed = getattr(self.transport.protocol, "_closed", None)
+        while True:
+            buffered = self._buffered()
+            if closed is None or buffered is None:
+                await self.writer.drain()
+                return
+            if closed.is_set():
+                raise ConnectionResetError("Connection lost")
+            if buffered <= _QUIC_HIGH_WATER:
+                return
+            await asyncio.sleep(_QUIC_DRAIN_INTERVAL)
+
+    def _buffered(self) -> Optional[int]:
+        """
+        Returns the amount of data on the stream which hasn't been
+        acknowledged yet, or `None` if it can't be found out.
+        """
+        try:
+            stream = self.transport.protocol._quic._streams.get(self.transport.stream_id)
+            return 0 if stream is None else len(stream.sender._buffer)
+        except AttributeError:
+            return None
+
+
+class _SessionTicketStore:
+    """Bounded in-memory store of QUIC session tickets."""
+
+    def __init__(self, max_tickets: int=10000):
+        self.max_tickets = max_tickets
+        self._tickets = OrderedDict()
+
+    def add(self, ticket):
+        self._tickets[ticket.ticket] = ticket
+        if len(self._tickets) > self.max_tickets:
+            self._tickets.popitem(last=False)
+
+    def pop(self, label):
+        return self._tickets.pop(label, None)
@@ -1,8 +1,12 @@
 from dataclasses import dataclass
+from typing import AsyncIterator, Iterable
+
+# Lines are sent in batches of roughly this many characters.
+_BATCH_SIZE = 64 * 1024
 
 
 class Menu(list):
-    """
+    r"""
     Convenience class for building menus.
 
     This is a list wrapper which serialises and concatenates any
@@ -17,11 +21,65 @@ class Menu(list):
             for _ in self
         )
 
+    def serialize_bytes(self) -> bytes:
+        """
+        Serialise the menu straight to the bytes sent to the client, with
+        CRLF line endings and the terminating `.` line.
+
+        This is what the :class:`Application
+        <gopher_server.application.Application>` uses, and it avoids the extra
+        copies made by encoding the output of :meth:`serialize`. Bytes
+        responses are sent unchanged, so a menu which never changes can be
+        serialised once and the result returned by the handler every time.
+        """
+        lines = [
+            # Format plain menu items inline to skip a method call per item.
+            "%s%s\t%s\t%s\t%s\r\n" % (_.type, _.name, _.selector, _.host, _.port)
+            if type(_) is MenuItem
+            else (_ if isinstance(_, str) else _.serialize()) + "\r\n"
+            for _ in self
+        ]
+        lines.append(".\r\n")
+        return "".join(lines).encode("utf-8")
+
+
+class LazyMenu:
+    r"""
+    A menu which generates its items while it's being sent.
+
+    This takes any iterable of :class:`MenuItem`\ s, :class:`InfoMenuItem`\ s
+    and strings, such as a generator. Unlike :class:`Menu`, the items are
+    serialised and sent in batches as they're produced rather than all being
+    built up front, so memory use stays the same however long the menu is.
+    Handlers can return it like any other response.
+
+    .. note:: The items can only be iterated over once.
+    """
+
+    def __init__(self, items: Iterable):
+        self.items = items
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        batch = []
+        batch_size = 0
+        for item in self.items:
+            line = (item if isinstance(item, str) else item.serialize()) + "\n"
+            batch.append(line)
+            batch_size += len(line)
+            if batch_size >= _BATCH_SIZE:
+                yield "".join(batch)
+                batch = []
+                batch_size = 0
+        if batch:
+            yield "".join(batch)
+
 
 @dataclass
 class MenuItem:
     """A menu item of any kind."""
 
+    __slots__ = ("type", "name", "selector", "host", "port")
+
     type: str # TODO enum
     name: str
     selector: str
@@ -43,6 +101,8 @@ class InfoMenuItem:
     values.
     """
 
+    __slots__ = ("name",)
+
     def __init__(self, name: str):
         self.name = name
 
@@ -0,0 +1,156 @@
+import os
+import sqlite3
+import threading
+
+from argparse import ArgumentParser
+from typing import List, Optional, Tuple
+
+from gopher_server.handlers import _directory_entries
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS directories (
+    path           TEXT PRIMARY KEY,
+    mtime_ns       INTEGER NOT NULL,
+    entries        TEXT NOT NULL,
+    subdirectories TEXT NOT NULL
+)
+"""
+
+
+def _join(values: List[str]) -> str:
+    # File names can't contain null characters, so they're safe separators.
+    return "\0".join(values)
+
+
+def _split(value: str) -> List[str]:
+    return value.split("\0") if value else []
+
+
+class MenuIndex:
+    """
+    Pre-built index of directory listings for generated menus.
+
+    The index is stored in an SQLite database at `index_path`, with one row
+    per directory holding the names and types of its entries. This avoids
+    listing the directory and detecting file types on every request, which
+    makes a big difference for directories with many thousands of files.
+
+    Build or update the index with :meth:`update`, or from the command line::
+
+        python -m gopher_server.menu_index /path/to/data /path/to/index.sqlite
+
+    Updates are incremental: only directories whose modification time has
+    changed are listed again. Then pass the index to a
+    :class:`DirectoryHandler <gopher_server.handlers.DirectoryHandler>`:
+
+    .. code-block::
+
+       handler = DirectoryHandler(
+           "/path/to/data", generate_menus=True,
+           menu_index=MenuIndex("/path/to/index.sqlite"),
+       )
+
+    .. note:: A directory's modification time only changes when entries are
+              added, removed or renamed, so changes to a file's contents
+              which change its type won't be picked up until the next time
+              its directory is re-indexed.
+    """
+
+    def __init__(self, index_path: str):
+        self.index_path = index_path
+        # SQLite connections can't be shared between threads, so each
+        # thread gets its own.
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.index_path)
+            connection.execute(_SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def get(self, path: str, mtime_ns: int) -> Optional[List[Tuple[str, str]]]:
+        """
+        Returns the `(type, name)` tuples for a directory, given its path
+        relative to the base path. Returns `None` if the directory isn't in
+        the index, or if `mtime_ns` shows it's changed since it was indexed.
+        """
+
+        row = self._connection().execute(
+            "SELECT mtime_ns, entries FROM directories WHERE path = ?", (path,),
+        ).fetchone()
+        if row is None or row[0] != mtime_ns:
+            return None
+        return [(entry[0], entry[1:]) for entry in _split(row[1])]
+
+    def update(self, base_path: str) -> int:
+        """
+        Updates the index for every directory under `base_path`, and returns
+        the number of directories which had to be listed again.
+        """
+
+        base_path = os.path.abspath(base_path)
+        connection = self._connection()
+        updated = 0
+        seen_paths = set()
+        seen_inodes = set()
+        pending = ["."]
+
+        with connection:
+            while pending:
+                path = pending.pop()
+                try:
+                    directory_stat = os.stat(os.path.join(base_path, path))
+                except OSError:
+                    continue
+
+                # Don't get caught in symlink loops.
+                inode = (directory_stat.st_dev, directory_stat.st_ino)
+                if inode in seen_inodes:
+                    continue
+                seen_inodes.add(inode)
+                seen_paths.add(path)
+
+                row = connection.execute(
+                    "SELECT mtime_ns, subdirectories FROM directories WHERE path = ?", (path,),
+                ).fetchone()
+                if row is not None and row[0] == directory_stat.st_mtime_ns:
+                    subdirectories = _split(row[1])
+                else:
+                    entries = _directory_entries(os.path.join(base_path, path))
+                    subdirectories = [name for file_type, name in entries if file_type == "1"]
+                    connection.execute(
+                        "INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?)",
+                        (
+                            path,
+                            directory_stat.st_mtime_ns,
+                            _join([file_type + name for file_type, name in entries]),
+                            _join(subdirectories),
+                        ),
+                    )
+                    updated += 1
+
+                pending.extend(
+                    os.path.normpath(os.path.join(path, name)) for name in subdirectories
+                )
+
+            for (path,) in connection.execute("SELECT path FROM directories").fetchall():
+                if path not in seen_paths:
+                    connection.execute("DELETE FROM directories WHERE path = ?", (path,))
+
+        return updated
+
+
+def main():
+    parser = ArgumentParser("gopher_server.menu_index")
+    parser.add_argument("base_path")
+    parser.add_argument("index_path")
+    args = parser.parse_args()
+
+    updated = MenuIndex(args.index_path).update(args.base_path)
+    print("Updated %s directories." % updated)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import asyncio
+
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict
+
+# Upper bounds of the request latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return "{%s}" % ",".join('%s="%s"' % (key, _escape(value)) for key, value in labels.items())
+
+
+class Metrics:
+    """
+    Collects metrics about the server, and renders them in the Prometheus text
+    format.
+
+    Pass an instance to an :class:`Application
+    <gopher_server.application.Application>` as the `metrics` argument. The
+    application records request latencies, split by handler, selector pattern
+    (for :class:`PatternHandler <gopher_server.handlers.PatternHandler>`) and
+    outcome, as well as the number of requests in flight and the statistics of
+    its :class:`ResponseCache <gopher_server.cache.ResponseCache>`. Listeners
+    record connection counts and bytes sent for the application they serve.
+
+    Recording only involves a few dict and list updates, so it's cheap enough
+    to leave enabled. The metrics can be exposed for scraping using
+    :func:`metrics_listener`, or with a view function:
+
+    .. code-block::
+
+       @handler.register("metrics")
+       def metrics_view(request):
+           return metrics.render()
+    """
+
+    def __init__(self):
+        self.connections = defaultdict(int)
+        self.open_connections = defaultdict(int)
+        self.bytes_sent = defaultdict(int)
+        self.requests_in_flight = 0
+        self.caches = {}
+        # (handler, pattern, outcome) -> bucket counts, followed by the sum of
+        # all latencies.
+        self._latencies = {}
+
+    def connection_opened(self, listener: str):
+        self.connections[listener] += 1
+        self.open_connections[listener] += 1
+
+    def connection_closed(self, listener: str):
+        self.open_connections[listener] -= 1
+
+    def observe_request(self, handler: str, pattern: str, outcome: str, seconds: float):
+        """Records the latency of a request."""
+        key = (handler, pattern, outcome)
+        histogram = self._latencies.get(key)
+        if histogram is None:
+            histogram = self._latencies[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        histogram[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def render(self) -> str:
+        """Renders the metrics in the Prometheus text format."""
+
+        lines = []
+
+        def counters(name: str, kind: str, help_text: str, values: Dict[str, int], label: str):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+            for key, value in sorted(values.items()):
+                lines.append("%s%s %s" % (name, _labels(**{label: key}), value))
+
+        counters(
+            "gopher_connections_total", "counter",
+            "Connections accepted.", self.connections, "listener",
+        )
+        counters(
+            "gopher_open_connections", "gauge",
+            "Connections currently open.", self.open_connections, "listener",
+        )
+        counters(
+            "gopher_bytes_sent_total", "counter",
+            "Response bytes sent.", self.bytes_sent, "listener",
+        )
+
+        lines.append("# HELP gopher_requests_in_flight Requests currently being dispatched.")
+        lines.append("# TYPE gopher_requests_in_flight gauge")
+        lines.append("gopher_requests_in_flight %s" % self.requests_in_flight)
+
+        lines.append("# HELP gopher_request_duration_seconds Time taken to dispatch requests.")
+        lines.append("# TYPE gopher_request_duration_seconds histogram")
+        for (handler, pattern, outcome), histogram in sorted(
+            self._latencies.items(), key=lambda item: tuple(str(_) for _ in item[0]),
+        ):
+            labels = {"handler": handler, "pattern": pattern or "", "outcome": outcome}
+            count = 0
+            for bound, bucket_count in zip(LATENCY_BUCKETS + ("+Inf",), histogram):
+                count += bucket_count
+                lines.append("gopher_request_duration_seconds_bucket%s %s" % (
+                    _labels(le=bound, **labels), count,
+                ))
+            lines.append("gopher_request_duration_seconds_sum%s %s" % (_labels(**labels), histogram[-1]))
+            lines.append("gopher_request_duration_seconds_count%s %s" % (_labels(**labels), count))
+
+        for name, attribute, kind in (
+            ("gopher_cache_hits_total", "hits", "counter"),
+            ("gopher_cache_misses_total", "misses", "counter"),
+            ("gopher_cache_evictions_total", "evictions", "counter"),
+            ("gopher_cache_size_bytes", "size", "gauge"),
+        ):
+            if self.caches:
+                lines.append("# TYPE %s %s" % (name, kind))
+            for cache_name, cache in sorted(self.caches.items()):
+                lines.append("%s%s %s" % (name, _labels(cache=cache_name), getattr(cache, attribute)))
+
+        return "\n".join(lines) + "\n"
+
+
+async def metrics_listener(metrics: Metrics, host: str, port: int):
+    """
+    Minimal HTTP listener which serves :meth:`Metrics.render` on any path, so
+    the metrics can be scraped by Prometheus.
+
+    Returns the :class:`asyncio.Server` so that it can be closed later.
+    """
+
+    async def handle_connection(reader, writer):
+        try:
+            # Skip the request line and headers.
+            while (await reader.readline()).strip():
+                pass
+            body = metrics.render().encode("utf-8")
+            writer.write(
+                b"HTTP/1.0 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                b"Content-Length: %d\r\n\r\n" % len(body)
+            )
+            writer.write(body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle_connection, host, port)
@@ -0,0 +1,223 @@
+import asyncio
+import re
+
+from collections.abc import AsyncIterable
+from functools import partial
+from logging import getLogger
+from time import perf_counter
+from typing import Dict, List
+from zope.interface import Interface, implementer
+
+from gopher_server.cache import ResponseCache
+from gopher_server.handlers import IHandler, Request
+from gopher_server.responses import EncodedResponse, _aclose, encode_response
+
+log = getLogger(__name__)
+
+
+class IMiddleware(Interface):
+    """
+    Interface for middleware classes.
+
+    Middlewares are given to an :class:`Application
+    <gopher_server.application.Application>` as a list, and run in order
+    around its handler. Each one can look at or change the request, answer it
+    without calling the rest of the chain, or change the response.
+    """
+
+    async def handle(self, request: Request, handler: IHandler):
+        """
+        Receives a :class:`Request <gopher_server.handlers.Request>` object
+        and the next handler in the chain, and returns a response in any of
+        the forms described in :meth:`IHandler.handle
+        <gopher_server.handlers.IHandler.handle>`. To pass the request on,
+        return `await handler.handle(request)`.
+        """
+
+
+@implementer(IHandler)
+class _Link:
+    """Runs one middleware with the rest of the chain as its handler."""
+
+    __slots__ = ("middleware", "handler")
+
+    def __init__(self, middleware: IMiddleware, handler: IHandler):
+        self.middleware = middleware
+        self.handler = handler
+
+    async def handle(self, request: Request):
+        return await self.middleware.handle(request, self.handler)
+
+
+def chain(middleware: List[IMiddleware], handler: IHandler) -> IHandler:
+    """
+    Combines a list of middlewares and a handler into a single handler. The
+    chain is built once, so calling it doesn't create any closures or other
+    objects for each request.
+    """
+    for item in reversed(middleware):
+        handler = _Link(item, handler)
+    return handler
+
+
+@implementer(IMiddleware)
+class TimingMiddleware:
+    """
+    Records how long the rest of the chain takes to handle each request,
+    grouped by the :class:`PatternHandler <gopher_server.handlers.PatternHandler>`
+    pattern (or `None` for other handlers).
+
+    :attr:`timings` maps each pattern to a `[count, total_seconds,
+    max_seconds]` list. If `slow_threshold` is set, requests which take longer
+    than that many seconds are logged as a warning.
+    """
+
+    def __init__(self, slow_threshold: float=None):
+        self.slow_threshold = slow_threshold
+        self.timings: Dict[str, list] = {}
+
+    async def handle(self, request: Request, handler: IHandler):
+        start = perf_counter()
+        try:
+            return await handler.handle(request)
+        finally:
+            seconds = perf_counter() - start
+            timing = self.timings.get(request.pattern)
+            if timing is None:
+                timing = self.timings[request.pattern] = [0, 0.0, 0.0]
+            timing[0] += 1
+            timing[1] += seconds
+            if seconds > timing[2]:
+                timing[2] = seconds
+            if self.slow_threshold is not None and seconds >= self.slow_threshold:
+                log.warning("Handling %r took %.3fs.", request.selector, seconds)
+
+
+@implementer(IMiddleware)
+class CacheMiddleware:
+    """
+    Answers requests from a :class:`ResponseCache
+    <gopher_server.cache.ResponseCache>` without calling the rest of the
+    chain.
+
+    This works like the `cache` argument of :class:`Application
+    <gopher_server.application.Application>`, but can be put anywhere in the
+    chain, for example after a middleware which rejects some requests. Text
+    and menu responses are encoded before they're cached, and are returned as
+    :class:`EncodedResponse <gopher_server.responses.EncodedResponse>`
+    objects. As with the application's cache, only responses with
+    :attr:`Request.dependencies <gopher_server.handlers.Request>` are cached.
+    """
+
+    def __init__(self, cache: ResponseCache):
+        self.cache = cache
+
+    async def handle(self, request: Request, handler: IHandler):
+        key = (request.selector, request.hostname, request.port)
+        data = await self.cache.get_async(key)
+        if data is not None:
+            return EncodedResponse(data)
+
+        response = await handler.handle(request)
+        if not request.dependencies:
+            return response
+
+        data = encode_response(response)
+        if data is None:
+            return response
+
+        self.cache.set(key, data, request.dependencies)
+        return EncodedResponse(data)
+
+
+@implementer(IMiddleware)
+class CoalescingMiddleware:
+    """
+    Shares the work between concurrent requests for the same selector.
+
+    When a request arrives while another with the same selector, hostname
+    and port is still being handled, it waits for the first one's response
+    instead of calling the rest of the chain again. This stops a burst of
+    requests for a popular but expensive page from computing it many times
+    over. Text and menu responses are encoded once and shared as
+    :class:`EncodedResponse <gopher_server.responses.EncodedResponse>`
+    objects. Streamed responses can't be shared, so requests which were
+    waiting for one are handled separately instead.
+
+    If `patterns` is given, only selectors matching one of the patterns
+    (in the same way as :class:`PatternHandler
+    <gopher_server.handlers.PatternHandler>` patterns) are coalesced.
+    Otherwise every request is. :attr:`coalesced` counts the requests which
+    were answered using another request's response.
+
+    The shared work carries on even if the request which started it is
+    cancelled, for example because its client disconnected, so the other
+    requests still get their response. If that response turns out to be
+    streamed, nobody else can use it, so it's closed.
+    """
+
+    def __init__(self, patterns: List[str]=None):
+        self.patterns = None
+        if patterns is not None:
+            self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.coalesced = 0
+        # (selector, hostname, port) -> (task, request)
+        self._in_flight = {}
+        # Keeps the tasks closing abandoned streams from being garbage
+        # collected while they run.
+        self._closing = set()
+
+    async def handle(self, request: Request, handler: IHandler):
+        if self.patterns is not None and not any(
+            pattern.fullmatch(request.selector) for pattern in self.patterns
+        ):
+            return await handler.handle(request)
+
+        key = (request.selector, request.hostname, request.port)
+        flight = self._in_flight.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(self._handle(request, handler))
+            flight = self._in_flight[key] = (task, request)
+            task.add_done_callback(partial(self._finished, key))
+        task, first_request = flight
+
+        try:
+            response = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if first_request is request:
+                if task.done():
+                    self._close_stream(task)
+                else:
+                    task.add_done_callback(self._close_stream)
+            raise
+        if first_request is request:
+            return response
+        if isinstance(response, AsyncIterable):
+            return await handler.handle(request)
+
+        self.coalesced += 1
+        request.dependencies.extend(first_request.dependencies)
+        request.pattern = first_request.pattern
+        return response
+
+    async def _handle(self, request: Request, handler: IHandler):
+        response = await handler.handle(request)
+        data = encode_response(response)
+        return response if data is None else EncodedResponse(data)
+
+    def _finished(self, key, task):
+        del self._in_flight[key]
+        # Retrieve the exception so it isn't reported as unhandled if every
+        # request waiting for it was cancelled.
+        if not task.cancelled():
+            task.exception()
+
+    def _close_stream(self, task):
+        """Closes a streamed response which its request stopped waiting for."""
+        if task.cancelled() or task.exception() is not None:
+            return
+        response = task.result()
+        if isinstance(response, AsyncIterable):
+            closing = asyncio.ensure_future(_aclose(response))
+            self._closing.add(closing)
+            closing.add_done_callback(self._closing.discard)
@@ -0,0 +1,212 @@
+import hashlib
+import mmap
+import os
+import posixpath
+import struct
+
+from argparse import ArgumentParser
+from typing import Optional
+from zope.interface import implementer
+
+from gopher_server.handlers import (
+    IHandler, NotFound, Request, _directory_entries, _menu_from_entries,
+)
+from gopher_server.responses import EncodedResponse, encode_text
+
+_MAGIC = b"GOPHPACK"
+_VERSION = 1
+
+# Magic, version, offset of the index, number of index records.
+_HEADER = struct.Struct("<8sIQQ")
+
+# Selector hash, key offset, key length, data offset, data length. Records
+# are sorted by hash so they can be binary searched in place.
+_RECORD = struct.Struct("<QQQQQ")
+
+
+def _selector_hash(key: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+
+
+def _encode_file(path: str) -> bytes:
+    """Encodes a file in the same way as `DirectoryHandler`."""
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        data.decode("utf-8")
+    except UnicodeDecodeError:
+        return data
+    return encode_text(data)
+
+
+def build_pack(base_path: str, pack_path: str, hostname: str=None, port: int=None) -> int:
+    """
+    Compiles every file under `base_path` into a pack file at `pack_path`,
+    and returns the number of selectors it contains.
+
+    Text files are stored ready to send, with CRLF line endings and the
+    terminating `.` line, and binary files are stored as they are. A
+    directory's selector serves its `index` file, as with
+    :class:`DirectoryHandler <gopher_server.handlers.DirectoryHandler>`. If
+    `hostname` and `port` are given, directories without an `index` file get
+    a generated menu using them for the links instead.
+
+    The pack is written to a temporary file and then moved into place, so a
+    running server never sees a partly written pack.
+    """
+
+    base_path = os.path.abspath(base_path)
+    records = []
+    temporary_path = pack_path + ".tmp"
+
+    with open(temporary_path, "wb") as f:
+        f.write(b"\0" * _HEADER.size)
+
+        def add(key: str, data: bytes):
+            encoded_key = key.encode("utf-8")
+            records.append([_selector_hash(encoded_key), encoded_key, f.tell(), len(data)])
+            f.write(data)
+
+        for directory, directory_names, file_names in os.walk(base_path):
+            directory_names.sort()
+            relative_directory = os.path.relpath(directory, base_path).replace(os.sep, "/")
+            if relative_directory == ".":
+                relative_directory = ""
+
+            for name in sorted(file_names):
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    add(posixpath.join(relative_directory, name), _encode_file(path))
+
+            index_path = os.path.join(directory, "index")
+            if os.path.isfile(index_path):
+                add(relative_directory, _encode_file(index_path))
+            elif hostname is not None and port is not None:
+                request = Request(hostname, port, relative_directory)
+                menu = _menu_from_entries(
+                    request, relative_directory, _directory_entries(directory),
+                )
+                add(relative_directory, menu.serialize_bytes())
+
+        # Keys are stored after the data so they can be checked on lookup.
+        for record in records:
+            encoded_key = record[1]
+            record[1] = f.tell()
+            record.insert(2, len(encoded_key))
+            f.write(encoded_key)
+
+        index_offset = f.tell()
+        for record in sorted(records):
+            f.write(_RECORD.pack(*record))
+
+        f.seek(0)
+        f.write(_HEADER.pack(_MAGIC, _VERSION, index_offset, len(records)))
+
+    os.replace(temporary_path, pack_path)
+    return len(records)
+
+
+@implementer(IHandler)
+class PackHandler:
+    """
+    Serves responses from a pack file built by :func:`build_pack`.
+
+    This is a faster alternative to :class:`DirectoryHandler
+    <gopher_server.handlers.DirectoryHandler>` for content which doesn't
+    change while the server is running. Build the pack from the command
+    line::
+
+        python -m gopher_server.pack /path/to/data /path/to/data.pack
+
+    The pack is memory-mapped rather than read, so creating the handler is
+    instant whatever its size, and the operating system's page cache is
+    shared between worker processes. Selectors are found with a binary search
+    of the index in the mapped file, and responses are returned as
+    :class:`memoryview` slices of it, so nothing is opened, read, decoded or
+    copied when serving a request.
+
+    To serve a new version of the content, build the pack again and call
+    :meth:`reload`. :func:`run_workers <gopher_server.workers.run_workers>`
+    does this in the parent process when it's sent `SIGHUP`, before the
+    replacement workers are forked, so they map the new pack.
+    """
+
+    def __init__(self, pack_path: str):
+        self.pack_path = pack_path
+        self.reload()
+
+    def reload(self):
+        """
+        Maps the pack file again, to pick up a pack which has been rebuilt
+        since. If the new file isn't a valid pack, this raises `ValueError`
+        and the old pack stays in use. Responses already returned from the
+        old pack stay valid until they've been sent.
+        """
+        with open(self.pack_path, "rb") as f:
+            pack = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, index_offset, count = _HEADER.unpack_from(pack)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError("%s is not a version %s pack file." % (self.pack_path, _VERSION))
+
+        # The old map is closed once nothing refers to it any more.
+        self._mmap = pack
+        self._view = memoryview(pack)
+        self._index_offset = index_offset
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def get(self, selector: str) -> Optional[memoryview]:
+        """Returns the encoded response for a selector, or `None`."""
+
+        # Normalise the selector in the same way as DirectoryHandler.
+        selector = posixpath.normpath("/" + selector.lstrip("/"))[1:]
+        key = selector.encode("utf-8")
+        selector_hash = _selector_hash(key)
+
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            record_hash = _RECORD.unpack_from(
+                self._mmap, self._index_offset + middle * _RECORD.size,
+            )[0]
+            if record_hash < selector_hash:
+                low = middle + 1
+            else:
+                high = middle
+
+        while low < self._count:
+            record_hash, key_offset, key_length, data_offset, data_length = _RECORD.unpack_from(
+                self._mmap, self._index_offset + low * _RECORD.size,
+            )
+            if record_hash != selector_hash:
+                break
+            if self._mmap[key_offset:key_offset + key_length] == key:
+                return self._view[data_offset:data_offset + data_length]
+            low += 1
+
+        return None
+
+    async def handle(self, request: Request) -> EncodedResponse:
+        data = self.get(request.selector)
+        if data is None:
+            raise NotFound
+        return EncodedResponse(data)
+
+
+def main():
+    parser = ArgumentParser("gopher_server.pack")
+    parser.add_argument("base_path")
+    parser.add_argument("pack_path")
+    parser.add_argument("--hostname", help="hostname for links in generated menus")
+    parser.add_argument("--port", type=int, default=70, help="port for links in generated menus")
+    args = parser.parse_args()
+
+    count = build_pack(args.base_path, args.pack_path, args.hostname, args.port)
+    print("Packed %s selectors." % count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import asyncio
+
+from dataclasses import dataclass
+from logging import getLogger
+from typing import AsyncIterator, Dict, Union
+from zope.interface import implementer
+
+from gopher_server.handlers import IHandler, NotFound, Request
+from gopher_server.responses import CHUNK_SIZE, EncodedResponse, _ClosingIterator
+
+log = getLogger(__name__)
+
+_UNAVAILABLE_RESPONSE = b"3Upstream server unavailable.\t\terror.host\t0\r\n.\r\n"
+
+# How much of the response to look at when deciding whether it's a menu.
+_MAX_FIRST_LINE = 4096
+
+
+@dataclass
+class Upstream:
+    """
+    An upstream Gopher server for :class:`ProxyHandler`.
+
+    * `host` and `port` are the address of the server.
+    * `selector_prefix` is added to the start of selectors sent to it.
+    * `max_connections` is the maximum number of requests sent to it at
+      once. Requests over the limit wait for a free slot.
+    * `connect_timeout` is the number of seconds allowed for getting a slot
+      and connecting, and `read_timeout` is the number of seconds allowed
+      between each chunk of the response.
+    * `rewrite_menus` controls whether links to the upstream server in menus
+      are changed to point to the proxy.
+    """
+
+    host: str
+    port: int = 70
+    selector_prefix: str = ""
+    max_connections: int = None
+    connect_timeout: float = None
+    read_timeout: float = None
+    rewrite_menus: bool = True
+
+
+@implementer(IHandler)
+class ProxyHandler:
+    """
+    Forwards requests to upstream Gopher servers.
+
+    `routes` maps selector prefixes to :class:`Upstream` servers. The longest
+    matching prefix is used, and is replaced by the upstream's
+    `selector_prefix` before the selector is sent on. Requests which don't
+    match any route raise :class:`NotFound <gopher_server.handlers.NotFound>`:
+
+    .. code-block::
+
+       handler = ProxyHandler({
+           "floodgap/": Upstream("gopher.floodgap.com", max_connections=10),
+           "docs/": Upstream("docs.example.com", selector_prefix="/gopher/"),
+       })
+
+    The response is streamed back to the client as it arrives. If it looks
+    like a menu, links to the upstream server are rewritten line by line to
+    point back through the proxy, so the menu is never held in memory as a
+    whole. Other responses are passed through unchanged.
+
+    Gopher only allows one request per connection, so connections can't be
+    reused. Instead, each upstream's `max_connections` bounds how many
+    connections are open to it at once.
+    """
+
+    def __init__(self, routes: Dict[str, Upstream]):
+        # Longest prefixes first, so the most specific route wins.
+        self.routes = sorted(routes.items(), key=lambda route: -len(route[0]))
+        self._semaphores = {}
+
+    async def handle(self, request: Request) -> Union[EncodedResponse, AsyncIterator[bytes]]:
+        for prefix, upstream in self.routes:
+            if request.selector.startswith(prefix):
+                break
+        else:
+            raise NotFound
+
+        request.pattern = prefix
+        upstream_selector = upstream.selector_prefix + request.selector[len(prefix):]
+
+        semaphore = None
+        if upstream.max_connections is not None:
+            # Routes to the same server share its connection limit.
+            key = (upstream.host, upstream.port)
+            semaphore = self._semaphores.get(key)
+            if semaphore is None:
+                semaphore = self._semaphores[key] = asyncio.Semaphore(upstream.max_connections)
+
+        try:
+            reader, writer = await asyncio.wait_for(
+                self._connect(upstream, semaphore), upstream.connect_timeout,
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            log.warning("Couldn't connect to %s:%s: %r", upstream.host, upstream.port, e)
+            return EncodedResponse(_UNAVAILABLE_RESPONSE)
+
+        writer.write(upstream_selector.encode("utf-8") + b"\r\n")
+        # The connection and its slot are released when the response is
+        # finished or closed, even if it's never started.
+        async def release():
+            writer.close()
+            if semaphore is not None:
+                semaphore.release()
+
+        return _ClosingIterator(self._stream(request, prefix, upstream, reader), release)
+
+    async def _connect(self, upstream: Upstream, semaphore):
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            return await asyncio.open_connection(upstream.host, upstream.port)
+        except BaseException:
+            if semaphore is not None:
+                semaphore.release()
+            raise
+
+    async def _stream(self, request: Request, prefix: str, upstream: Upstream,
+                      reader) -> AsyncIterator[bytes]:
+        async def read():
+            if upstream.read_timeout is None:
+                return await reader.read(CHUNK_SIZE)
+            return await asyncio.wait_for(reader.read(CHUNK_SIZE), upstream.read_timeout)
+
+        chunk = await read()
+        if not upstream.rewrite_menus:
+            rewriter = None
+        else:
+            # Only the first line is needed to decide whether it's a menu.
+            while b"\n" not in chunk and len(chunk) < _MAX_FIRST_LINE:
+                more = await read()
+                if not more:
+                    break
+                chunk += more
+            rewriter = _MenuRewriter(request, prefix, upstream)
+            if not rewriter.is_menu(chunk):
+                rewriter = None
+
+        while chunk:
+            yield chunk if rewriter is None else rewriter.feed(chunk)
+            chunk = await read()
+        if rewriter is not None:
+            yield rewriter.feed(b"", final=True)
+
+
+class _MenuRewriter:
+    """Rewrites links to the upstream server in a menu, a chunk at a time."""
+
+    def __init__(self, request: Request, prefix: str, upstream: Upstream):
+        self.upstream_host = upstream.host.lower().encode("utf-8")
+        self.upstream_port = upstream.port
+        self.upstream_prefix = upstream.selector_prefix.encode("utf-8")
+        self.prefix = prefix.encode("utf-8")
+        self.hostname = request.hostname.encode("utf-8")
+        self.port = str(request.port).encode("ascii")
+        self._partial_line = b""
+
+    @staticmethod
+    def is_menu(data: bytes) -> bool:
+        """Checks whether the first line of a response looks like a menu item."""
+        fields = data.split(b"\n", 1)[0].rstrip(b"\r").split(b"\t")
+        return len(fields) >= 4 and fields[3].strip().isdigit()
+
+    def feed(self, chunk: bytes, final: bool=False) -> bytes:
+        lines = (self._partial_line + chunk).split(b"\n")
+        if final:
+            self._partial_line = b""
+            return b"\n".join(self._rewrite(line) for line in lines)
+        self._partial_line = lines.pop()
+        return b"".join(self._rewrite(line) + b"\n" for line in lines)
+
+    def _rewrite(self, line: bytes) -> bytes:
+        fields = line.split(b"\t")
+        if len(fields) < 4:
+            return line
+        port = fields[3].rstrip(b"\r")
+        if (
+            fields[2].lower() != self.upstream_host
+            or not port.isdigit() or int(port) != self.upstream_port
+            or not fields[1].startswith(self.upstream_prefix)
+        ):
+            return line
+        fields[1] = self.prefix + fields[1][len(self.upstream_prefix):]
+        fields[2] = self.hostname
+        fields[3] = fields[3].replace(port, self.port)
+        return b"\t".join(fields)
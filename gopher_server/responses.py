@@ -0,0 +1,137 @@
+import asyncio
+
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Optional, Union
+
+from gopher_server.menu import Menu
+
+# Size of the reads used when a file has to be copied through userspace.
+CHUNK_SIZE = 64 * 1024
+
+
+@dataclass
+class FileResponse:
+    """
+    A binary response which is streamed straight from a file.
+
+    Handlers can return this instead of reading the file themselves. The file
+    is sent as-is without any encoding or line ending conversion, and the
+    listener is free to use `sendfile` to avoid copying it into memory at all.
+
+    If the file has to be copied through userspace instead, it's read in
+    `executor` when one is given, so that slow disks don't block the event
+    loop.
+    """
+
+    path: str
+    executor: Executor = field(default=None, repr=False, compare=False)
+
+
+async def _read_chunks(path: str, executor: Executor=None) -> AsyncIterator[bytes]:
+    """
+    Yields the contents of a file in `CHUNK_SIZE` chunks. The file is opened
+    and read in `executor` if one is given, and on the event loop otherwise.
+    """
+
+    loop = asyncio.get_running_loop()
+
+    async def call(function, *args):
+        if executor is None:
+            return function(*args)
+        return await loop.run_in_executor(executor, function, *args)
+
+    f = await call(open, path, "rb")
+    try:
+        while True:
+            chunk = await call(f.read, CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+    finally:
+        f.close()
+
+
+async def _aclose(iterator):
+    """Closes an async iterator, if it can be closed."""
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+class _ClosingIterator:
+    """
+    Wraps an async iterator, and calls `close` once the iterator is finished,
+    fails, or is closed with `aclose()`. Unlike an async generator's `finally`
+    block, this also works if the iterator was never started.
+    """
+
+    def __init__(self, iterator: AsyncIterator, close: Callable[[], Awaitable]):
+        self._iterator = iterator
+        self._close = close
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._iterator.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if self._close is None:
+            return
+        close, self._close = self._close, None
+        try:
+            await self._iterator.aclose()
+        finally:
+            await close()
+
+
+def encode_text(text: Union[str, bytes]) -> bytes:
+    """
+    Encodes a text response for sending to the client, converting line
+    endings to CRLF and adding the terminating `.` line.
+    """
+    if isinstance(text, str):
+        text = text.encode("utf-8")
+    data = text.replace(b"\n", b"\r\n")
+    return data + (b".\r\n" if data.endswith(b"\r\n") else b"\r\n.\r\n")
+
+
+@dataclass
+class EncodedResponse:
+    """
+    A response which is already in the exact form sent to the client.
+
+    Unlike returning plain bytes, this marks the response as text which has
+    already been through :func:`encode_text`, for example by a handler which
+    reads UTF-8 files as bytes and never needs to decode them. The data is
+    sent without being copied or converted again. The data can be any
+    bytes-like object, such as a :class:`memoryview` of a memory-mapped file.
+    """
+
+    data: bytes
+
+    @classmethod
+    def from_text(cls, text: Union[str, bytes]) -> "EncodedResponse":
+        """Creates an encoded response from UTF-8 text."""
+        return cls(encode_text(text))
+
+
+def encode_response(response) -> Optional[bytes]:
+    """
+    Returns the bytes sent to the client for a text response: a string, a
+    :class:`Menu <gopher_server.menu.Menu>` or an :class:`EncodedResponse`.
+    Returns `None` for other responses (binary data, files and streams),
+    which are sent as they are.
+    """
+    if isinstance(response, EncodedResponse):
+        return response.data
+    if isinstance(response, Menu):
+        return response.serialize_bytes()
+    if isinstance(response, str):
+        return encode_text(response)
+    return None
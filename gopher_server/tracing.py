@@ -0,0 +1,156 @@
+import os
+import random
+
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from logging import getLogger
+from time import perf_counter
+from typing import Dict, Iterator, Optional
+
+log = getLogger(__name__)
+
+_current_trace = ContextVar("gopher_server_trace", default=None)
+
+_NO_SPAN = nullcontext()
+
+
+class Trace:
+    """
+    Timings for the phases of a single request.
+
+    Time spent in each named span is added up, so a span which is entered
+    several times in one request (such as sniffing the type of each file in a
+    generated menu) shows up as a single total.
+    """
+
+    __slots__ = ("selector", "start", "spans", "profiler")
+
+    def __init__(self):
+        self.selector = None
+        self.start = perf_counter()
+        self.spans: Dict[str, float] = {}
+        self.profiler = None
+
+    def add(self, name: str, seconds: float):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace: Trace, name: str):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.trace.add(self.name, perf_counter() - self.start)
+
+
+def current_trace() -> Optional[Trace]:
+    """Returns the trace for the request currently being handled, if any."""
+    return _current_trace.get()
+
+
+def span(name: str):
+    """
+    Context manager which times a phase of the current request. Does nothing
+    if the request isn't being traced, so it's cheap to leave in place:
+
+    .. code-block::
+
+       with span("database"):
+           rows = fetch_rows()
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name)
+
+
+class Tracer:
+    """
+    Times the phases of each request, logs slow requests and optionally
+    profiles a sample of requests.
+
+    Pass an instance to an :class:`Application
+    <gopher_server.application.Application>` as the `tracer` argument. The
+    listeners, the application and :class:`DirectoryHandler
+    <gopher_server.handlers.DirectoryHandler>` then record spans for reading
+    the selector, running the handler, file system work, serialising the
+    response and writing it. Views can add their own with :func:`span`.
+
+    Requests which take longer than `slow_threshold` seconds are logged as a
+    warning along with their spans.
+
+    While :attr:`profiling` is enabled, a `profile_rate` fraction of requests
+    are run under :mod:`cProfile` and the results are written to `.pstats`
+    files in `profile_dir`. Only one request is profiled at a time. The
+    profiler sees everything the process does while the request is in
+    progress, including other requests running concurrently, so treat the
+    results as a profile of the server around that request. Profiling can be
+    switched on and off at runtime with :meth:`toggle_profiling`, which the
+    main script and :func:`run_workers <gopher_server.workers.run_workers>`
+    call on `SIGUSR2`.
+    """
+
+    def __init__(self, slow_threshold: float=None, profile_rate: float=0.01,
+                 profile_dir: str="."):
+        self.slow_threshold = slow_threshold
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        self.profiling = False
+        self._profile_active = False
+        self._profile_count = 0
+
+    def toggle_profiling(self):
+        """Switches sampling profiling on or off."""
+        self.profiling = not self.profiling
+        log.info("Profiling %s.", "enabled" if self.profiling else "disabled")
+
+    @contextmanager
+    def trace(self) -> Iterator[Trace]:
+        """
+        Context manager which traces one request. Spans recorded inside it are
+        added to the returned :class:`Trace`.
+        """
+
+        trace = Trace()
+        if self.profiling and not self._profile_active and random.random() < self.profile_rate:
+            import cProfile
+            self._profile_active = True
+            trace.profiler = cProfile.Profile()
+            trace.profiler.enable()
+
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            self._finish(trace)
+
+    def _finish(self, trace: Trace):
+        total = perf_counter() - trace.start
+
+        if trace.profiler is not None:
+            trace.profiler.disable()
+            self._profile_active = False
+            self._profile_count += 1
+            path = os.path.join(
+                self.profile_dir, "gopher-%s-%s.pstats" % (os.getpid(), self._profile_count),
+            )
+            try:
+                trace.profiler.dump_stats(path)
+            except OSError as e:
+                log.error("Couldn't write profile:", exc_info=e)
+            else:
+                log.info("Profiled request %r (%.3fs) to %s.", trace.selector, total, path)
+
+        if self.slow_threshold is not None and total >= self.slow_threshold:
+            log.warning(
+                "Slow request %r took %.3fs (%s).",
+                trace.selector, total,
+                ", ".join("%s %.3fs" % item for item in trace.spans.items()),
+            )
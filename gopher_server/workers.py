@@ -0,0 +1,217 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+
+from logging import getLogger
+from typing import Awaitable, Callable, List
+
+from gopher_server.application import Application
+
+log = getLogger(__name__)
+
+_SIGNALS = {
+    signal.SIGCHLD, signal.SIGHUP, signal.SIGINT, signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2,
+}
+
+
+class _CountingApplication:
+    """Wraps an application to count requests in shared memory."""
+
+    def __init__(self, application: Application, counters, slot: int):
+        self.application = application
+        self.counters = counters
+        self.slot = slot
+        # Let listeners record metrics and traces with the wrapped
+        # application's objects.
+        self.metrics = getattr(application, "metrics", None)
+        self.tracer = getattr(application, "tracer", None)
+
+    async def dispatch(self, hostname: str, port: int, selector: bytes):
+        self.counters[self.slot] += 1
+        return await self.application.dispatch(hostname, port, selector)
+
+
+def _reload_handler(application: Application):
+    """Calls the handler's `reload()` method, if it has one."""
+    reload = getattr(getattr(application, "handler", None), "reload", None)
+    if reload is None:
+        return
+    try:
+        reload()
+    except Exception as e:
+        log.error("Couldn't reload the handler, keeping the old one:", exc_info=e)
+
+
+def _close_handler(application: Application):
+    """Calls the handler's `close()` method, if it has one."""
+    close = getattr(getattr(application, "handler", None), "close", None)
+    if close is not None:
+        close()
+
+
+async def _drain(application: Application, servers: list, drain_timeout: float):
+    """
+    Stops accepting connections, waits for open ones to finish and closes
+    the handler.
+    """
+
+    for server in servers:
+        server.close()
+
+    tasks = asyncio.all_tasks() - {asyncio.current_task()}
+    if tasks:
+        await asyncio.wait(tasks, timeout=drain_timeout)
+
+    _close_handler(application)
+    asyncio.get_running_loop().stop()
+
+
+def _run_worker(application: Application, listeners: list, counters, slot: int,
+                drain_timeout: float):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.pthread_sigmask(signal.SIG_UNBLOCK, _SIGNALS)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    tracer = getattr(application, "tracer", None)
+    if tracer is not None:
+        loop.add_signal_handler(signal.SIGUSR2, tracer.toggle_profiling)
+    else:
+        signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+
+    counting_application = _CountingApplication(application, counters, slot)
+    try:
+        servers = loop.run_until_complete(
+            asyncio.gather(*(listener(counting_application) for listener in listeners))
+        )
+        loop.add_signal_handler(
+            signal.SIGTERM,
+            lambda: loop.create_task(_drain(application, servers, drain_timeout)),
+        )
+        loop.run_forever()
+    finally:
+        _close_handler(application)
+
+
+def run_workers(application: Application, listeners: List[Callable[[Application], Awaitable]],
+                workers: int, drain_timeout: float=30):
+    """
+    Runs the application in several forked worker processes.
+
+    Each of the `listeners` is called with the application in every worker,
+    and should start a listener with `reuse_port` enabled so that the workers
+    can share the port. For example:
+
+    .. code-block::
+
+       run_workers(application, [
+           partial(tcp_listener, hostname="localhost", host="0.0.0.0",
+                   port=7000, reuse_port=True),
+       ], workers=4)
+
+    This blocks until the server is shut down, and is controlled by signals
+    sent to the parent process:
+
+    * `SIGHUP` gracefully restarts the workers. If the application's handler
+      has a `reload()` method (such as :meth:`PackHandler.reload
+      <gopher_server.pack.PackHandler.reload>`), it's called first. A
+      replacement is then started for each worker, and the old one stops
+      accepting connections and exits once its open connections are
+      finished (or after `drain_timeout` seconds). Workers call the
+      handler's `close()` method, if it has one (such as
+      :meth:`PatternHandler.close <gopher_server.handlers.PatternHandler.close>`),
+      before they exit.
+    * `SIGTERM` or `SIGINT` gracefully stops the workers and exits. Sending
+      it a second time kills them immediately.
+    * `SIGUSR1` logs the number of requests served by each worker, and the
+      total across all of them.
+    * `SIGUSR2` is passed on to the workers, where it toggles profiling if
+      the application has a :class:`Tracer <gopher_server.tracing.Tracer>`.
+
+    Workers which exit unexpectedly are restarted.
+
+    .. note:: This uses `fork` and `SO_REUSEPORT`, so it's only available on
+              Unix-like systems.
+    """
+
+    # Each worker is the only writer of its own counter, so they don't need
+    # a lock shared between processes.
+    counters = multiprocessing.Array("Q", workers, lock=False)
+    processes = {}
+    stopping = set()
+    shutting_down = False
+
+    def spawn(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_worker(application, listeners, counters, slot, drain_timeout)
+            except BaseException as e:
+                log.error("Worker %s crashed:", slot, exc_info=e)
+                os._exit(1)
+            os._exit(0)
+        processes[pid] = slot
+
+    def log_stats():
+        log.info(
+            "Served %s requests (%s per worker).",
+            sum(counters), ", ".join(str(count) for count in counters),
+        )
+
+    # Signals are handled synchronously with sigwait rather than with signal
+    # handlers.
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    signal.pthread_sigmask(signal.SIG_BLOCK, _SIGNALS)
+
+    try:
+        for slot in range(workers):
+            spawn(slot)
+
+        while processes:
+            signum = signal.sigwait(_SIGNALS)
+
+            if signum == signal.SIGCHLD:
+                while True:
+                    try:
+                        pid, status = os.waitpid(-1, os.WNOHANG)
+                    except ChildProcessError:
+                        break
+                    if pid == 0:
+                        break
+                    slot = processes.pop(pid, None)
+                    if pid in stopping:
+                        stopping.discard(pid)
+                    elif slot is not None and not shutting_down:
+                        log.warning("Worker %s exited unexpectedly, restarting.", slot)
+                        spawn(slot)
+
+            elif signum == signal.SIGHUP and not shutting_down:
+                log.info("Restarting workers.")
+                _reload_handler(application)
+                for pid, slot in list(processes.items()):
+                    if pid not in stopping:
+                        spawn(slot)
+                        os.kill(pid, signal.SIGTERM)
+                        stopping.add(pid)
+
+            elif signum == signal.SIGUSR1:
+                log_stats()
+
+            elif signum == signal.SIGUSR2:
+                for pid in processes:
+                    os.kill(pid, signal.SIGUSR2)
+
+            elif signum in (signal.SIGINT, signal.SIGTERM):
+                kill_signal = signal.SIGKILL if shutting_down else signal.SIGTERM
+                shutting_down = True
+                log.info("Stopping workers.")
+                for pid in processes:
+                    os.kill(pid, kill_signal)
+                    stopping.add(pid)
+
+    finally:
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, _SIGNALS)
+
+    log_stats()
@@ -23,7 +23,10 @@ TESTS_REQUIRE = ["pytest", "pytest-asyncio"]
 
 EXTRAS = {
     "automenu": ["filetype"],
-    "quic":     ["aioquic", "cryptography"],
+    # quic_listener relies on some of aioquic's internals, which have been
+    # tested with the 1.x releases.
+    "quic":     ["aioquic>=1.0,<2", "cryptography"],
+    "uvloop":   ["uvloop"],
 }
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -5,6 +5,23 @@ from zope.interface import implementer
 
 from gopher_server.application import Application
 from gopher_server.handlers import IHandler, NotFound, Request
+from gopher_server.menu import Menu, MenuItem
+from gopher_server.responses import EncodedResponse
+
+
+async def text_stream():
+    yield "foo\n"
+    yield "bar"
+
+
+async def binary_stream():
+    yield b"foo\n"
+    yield b"bar"
+
+
+async def not_found_stream():
+    raise NotFound
+    yield ""
 
 
 @implementer(IHandler)
@@ -16,6 +33,21 @@ class TestHandler:
         if request.selector == "bytes":
             return b"test"
 
+        if request.selector == "encoded":
+            return EncodedResponse.from_text(b"foo\nbar")
+
+        if request.selector == "menu":
+            return Menu([MenuItem("0", "foo", "foo", "localhost", 7000)])
+
+        if request.selector == "text_stream":
+            return text_stream()
+
+        if request.selector == "binary_stream":
+            return binary_stream()
+
+        if request.selector == "not_found_stream":
+            return not_found_stream()
+
         if request.selector == "exception":
             raise Exception
 
@@ -41,6 +73,41 @@ async def test_binary(application: Application):
     assert response == b"test"
 
 
+@pytest.mark.asyncio
+async def test_encoded(application: Application):
+    """Encoded responses are sent as they are."""
+    response = await application.dispatch("localhost", 7000, b"encoded\r\n")
+    assert response == b"foo\r\nbar\r\n.\r\n"
+
+
+@pytest.mark.asyncio
+async def test_menu(application: Application):
+    """Menus have CRLF line endings and finish with a dot."""
+    response = await application.dispatch("localhost", 7000, b"menu\r\n")
+    assert response == b"0foo\tfoo\tlocalhost\t7000\r\n.\r\n"
+
+
+@pytest.mark.asyncio
+async def test_text_stream(application: Application):
+    """Streamed text is converted chunk by chunk and finishes with a dot."""
+    response = await application.dispatch("localhost", 7000, b"text_stream\r\n")
+    assert [chunk async for chunk in response] == [b"foo\r\n", b"bar", b"\r\n.\r\n"]
+
+
+@pytest.mark.asyncio
+async def test_binary_stream(application: Application):
+    """Streamed binary responses are passed through unchanged."""
+    response = await application.dispatch("localhost", 7000, b"binary_stream\r\n")
+    assert [chunk async for chunk in response] == [b"foo\n", b"bar"]
+
+
+@pytest.mark.asyncio
+async def test_stream_not_found(application: Application):
+    """NotFound raised before the first chunk still serves a not found error."""
+    response = await application.dispatch("localhost", 7000, b"not_found_stream\r\n")
+    assert response == b"3Not found.\t\terror.host\t0\r\n.\r\n"
+
+
 @pytest.mark.asyncio
 async def test_disallowed_characters(application: Application):
     """The CR, LF and tab characters aren't allowed in selectors."""
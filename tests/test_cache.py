@@ -0,0 +1,74 @@
+import os
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from gopher_server.application import Application
+from gopher_server.cache import ResponseCache
+from gopher_server.handlers import DirectoryHandler
+
+
+def test_cache_eviction():
+    """Least recently used entries are evicted to stay within max_bytes."""
+    cache = ResponseCache(max_bytes=10)
+    cache.set("a", b"aaaa", [])
+    cache.set("b", b"bbbb", [])
+    assert cache.get("a") == b"aaaa"
+    cache.set("c", b"cccc", [])
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    assert cache.get("c") == b"cccc"
+    assert cache.size == 8
+    assert cache.evictions == 1
+
+
+def test_cache_too_large():
+    """Responses larger than the whole cache aren't cached."""
+    cache = ResponseCache(max_bytes=2)
+    cache.set("a", b"aaaa", [])
+    assert cache.get("a") is None
+    assert cache.size == 0
+
+
+def test_cache_invalidation(tmp_path):
+    """Entries are thrown away when a dependency's mtime changes."""
+    path = tmp_path / "file"
+    path.write_text("foo")
+    cache = ResponseCache(max_bytes=100)
+    cache.set("a", b"foo", [(str(path), path.stat().st_mtime_ns)])
+    assert cache.get("a") == b"foo"
+    os.utime(path, ns=(0, 0))
+    assert cache.get("a") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_cache_executor(tmp_path):
+    """Dependencies can be checked in an executor."""
+    path = tmp_path / "file"
+    path.write_text("foo")
+    with ThreadPoolExecutor(1) as executor:
+        cache = ResponseCache(max_bytes=100, executor=executor)
+        cache.set("a", b"foo", [(str(path), path.stat().st_mtime_ns)])
+        assert await cache.get_async("a") == b"foo"
+        os.utime(path, ns=(0, 0))
+        assert await cache.get_async("a") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_application_cache(tmp_path):
+    """Cached responses are served until the file changes."""
+    path = tmp_path / "file"
+    path.write_text("foo")
+    cache = ResponseCache(max_bytes=100)
+    application = Application(DirectoryHandler(str(tmp_path)), cache=cache)
+
+    assert await application.dispatch("localhost", 7000, b"file\r\n") == b"foo\r\n.\r\n"
+    assert await application.dispatch("localhost", 7000, b"file\r\n") == b"foo\r\n.\r\n"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    path.write_text("bar")
+    os.utime(path, ns=(0, 0))
+    assert await application.dispatch("localhost", 7000, b"file\r\n") == b"bar\r\n.\r\n"
+    assert (cache.hits, cache.misses) == (1, 2)
@@ -1,8 +1,13 @@
+import asyncio
 import os.path
 import pytest
+import threading
+import time
 
+from gopher_server import handlers
 from gopher_server.handlers import DirectoryHandler, NotFound, PatternHandler, Request
 from gopher_server.menu import Menu, MenuItem
+from gopher_server.responses import EncodedResponse, FileResponse, encode_text
 
 
 BASE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples/data/")
@@ -20,18 +25,17 @@ def directory_handler_with_menus() -> DirectoryHandler:
 
 @pytest.mark.asyncio
 async def test_directory_handler_file(directory_handler: DirectoryHandler):
-    """File path returns file from the directory."""
+    """File path returns the encoded text file from the directory."""
     response = await directory_handler.handle(Request("localhost", 7000, "example"))
     with open(os.path.join(BASE_PATH + "example")) as f:
-        assert response == f.read()
+        assert response == EncodedResponse.from_text(f.read())
 
 
 @pytest.mark.asyncio
 async def test_directory_handler_binary(directory_handler: DirectoryHandler):
-    """Binary files are returned as bytes."""
+    """Binary files are returned as a FileResponse."""
     response = await directory_handler.handle(Request("localhost", 7000, "image.png"))
-    with open(os.path.join(BASE_PATH + "image.png"), "rb") as f:
-        assert response == f.read()
+    assert response == FileResponse(os.path.join(BASE_PATH, "image.png"))
 
 
 @pytest.mark.asyncio
@@ -39,7 +43,7 @@ async def test_directory_handler_directory(directory_handler: DirectoryHandler):
     """Directory name returns index file from the directory."""
     response = await directory_handler.handle(Request("localhost", 7000, ""))
     with open(os.path.join(BASE_PATH + "index")) as f:
-        assert response == f.read()
+        assert response == EncodedResponse.from_text(f.read())
 
 
 @pytest.mark.asyncio
@@ -70,6 +74,193 @@ async def test_directory_handler_with_menus_subdirectory(directory_handler_with_
     ])
 
 
+@pytest.mark.asyncio
+async def test_directory_handler_file_type_cache(tmp_path, monkeypatch):
+    """File types are sniffed once per file version, and not at all for known extensions."""
+    guessed = []
+    monkeypatch.setattr(handlers, "_guess_file_type", lambda path: guessed.append(path) or "0")
+    (tmp_path / "a").write_text("foo")
+    (tmp_path / "b.png").write_text("not really a png")
+
+    handler = DirectoryHandler(str(tmp_path), generate_menus=True)
+    for _ in range(2):
+        response = await handler.handle(Request("localhost", 7000, ""))
+        assert response == Menu([
+            MenuItem("0", "a",     "a",     "localhost", 7000),
+            MenuItem("I", "b.png", "b.png", "localhost", 7000),
+        ])
+    assert guessed == [str(tmp_path / "a")]
+
+
+@pytest.mark.asyncio
+async def test_directory_handler_file_type_cache_threads(tmp_path, monkeypatch):
+    """The file type cache stays bounded when menus are generated in several threads."""
+    monkeypatch.setattr(handlers, "_file_type_cache", handlers.OrderedDict())
+    monkeypatch.setattr(handlers, "_FILE_TYPE_CACHE_SIZE", 8)
+    monkeypatch.setattr(handlers, "_guess_file_type", lambda path: "0")
+    for i in range(100):
+        (tmp_path / str(i)).write_text("foo")
+
+    handler = DirectoryHandler(str(tmp_path), generate_menus=True, io_threads=8, io_queue_size=32)
+    responses = await asyncio.gather(*[
+        handler.handle(Request("localhost", 7000, "")) for _ in range(32)
+    ])
+    assert all(len(response) == 100 for response in responses)
+    assert len(handlers._file_type_cache) <= 8
+
+
+@pytest.mark.asyncio
+async def test_directory_handler_menu_pages():
+    """Generated menus can be split into pages."""
+    handler = DirectoryHandler(BASE_PATH, generate_menus=True, menu_page_size=3)
+
+    response = await handler.handle(Request("localhost", 7000, ""))
+    assert response == Menu([
+        MenuItem("0", "example",   "example",   "localhost", 7000),
+        MenuItem("I", "image.png", "image.png", "localhost", 7000),
+        MenuItem("0", "index",     "index",     "localhost", 7000),
+        MenuItem("1", "Next page", "?page=2",   "localhost", 7000),
+    ])
+
+    response = await handler.handle(Request("localhost", 7000, "?page=2"))
+    assert response == Menu([
+        MenuItem("1", "test",          "test",    "localhost", 7000),
+        MenuItem("1", "Previous page", "?page=1", "localhost", 7000),
+    ])
+
+    with pytest.raises(NotFound):
+        await handler.handle(Request("localhost", 7000, "?page=3"))
+
+    with pytest.raises(NotFound):
+        await handler.handle(Request("localhost", 7000, "example?page=2"))
+
+
+@pytest.mark.asyncio
+async def test_directory_handler_large_files(tmp_path):
+    """Large files are streamed as text only if their extension says they're text."""
+    text = "line\n" * 100000
+    (tmp_path / "text.txt").write_text(text)
+    # Valid UTF-8 at the start, like an ISO image.
+    (tmp_path / "image.iso").write_bytes(b"\0" * 32768 + b"CD001\n" + b"\xff" * 100000)
+    (tmp_path / "text").write_text(text)
+    handler = DirectoryHandler(str(tmp_path), stream_text_size=1024)
+
+    response = await handler.handle(Request("localhost", 7000, "text.txt"))
+    assert not isinstance(response, EncodedResponse)
+    assert b"".join([chunk async for chunk in response]) == encode_text(text)
+
+    for name in ("image.iso", "text"):
+        response = await handler.handle(Request("localhost", 7000, name))
+        assert response == FileResponse(str(tmp_path / name))
+
+
+@pytest.mark.asyncio
+async def test_directory_handler_io_threads():
+    """Directory handler with io_threads does the same work in a thread pool."""
+    handler = DirectoryHandler(BASE_PATH, io_threads=2)
+    response = await handler.handle(Request("localhost", 7000, "example"))
+    with open(os.path.join(BASE_PATH + "example")) as f:
+        assert response == EncodedResponse.from_text(f.read())
+
+
+@pytest.mark.asyncio
+async def test_directory_handler_io_timeout():
+    """Slow file system access times out without blocking the event loop."""
+    class SlowDirectoryHandler(DirectoryHandler):
+        def _handle(self, request):
+            time.sleep(0.2)
+            return super()._handle(request)
+
+    handler = SlowDirectoryHandler(BASE_PATH, io_threads=1, io_timeout=0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        await handler.handle(Request("localhost", 7000, "example"))
+
+
+def process_view(request, name):
+    """View run in a process pool, so it has to be defined at module level."""
+    request.dependencies.append(("/" + name, 1))
+    return "hello %s from %s" % (name, os.getpid())
+
+
+def test_directory_handler_io_timeout_needs_threads():
+    """io_timeout without io_threads is rejected rather than ignored."""
+    with pytest.raises(ValueError):
+        DirectoryHandler(BASE_PATH, io_timeout=1)
+
+
+@pytest.mark.asyncio
+async def test_directory_handler_io_queue_full():
+    """Requests over the thread pool's queue size are shed."""
+    release = threading.Event()
+
+    class BlockingDirectoryHandler(DirectoryHandler):
+        def _handle(self, request):
+            release.wait(5)
+            return super()._handle(request)
+
+    handler = BlockingDirectoryHandler(BASE_PATH, io_threads=1, io_queue_size=1)
+    tasks = [
+        asyncio.ensure_future(handler.handle(Request("localhost", 7000, "example")))
+        for _ in range(2)
+    ]
+    await asyncio.sleep(0.05)
+    shed_response = await handler.handle(Request("localhost", 7000, "example"))
+    release.set()
+    responses = await asyncio.gather(*tasks)
+
+    assert shed_response == EncodedResponse(b"3Server busy.\t\terror.host\t0\r\n.\r\n")
+    with open(os.path.join(BASE_PATH + "example")) as f:
+        assert responses == [EncodedResponse.from_text(f.read())] * 2
+
+
+@pytest.mark.asyncio
+async def test_directory_handler_io_timeout_queued():
+    """Queued requests which time out are dropped rather than run later."""
+    release = threading.Event()
+    calls = []
+
+    class BlockingDirectoryHandler(DirectoryHandler):
+        def _handle(self, request):
+            calls.append(request.selector)
+            release.wait(5)
+            return super()._handle(request)
+
+    handler = BlockingDirectoryHandler(BASE_PATH, io_threads=1, io_queue_size=1, io_timeout=0.05)
+    results = await asyncio.gather(*[
+        handler.handle(Request("localhost", 7000, selector)) for selector in ("example", "queued")
+    ], return_exceptions=True)
+    release.set()
+    handler._executor.shutdown()
+    # Let the done callbacks run.
+    await asyncio.sleep(0.01)
+
+    assert all(isinstance(result, asyncio.TimeoutError) for result in results)
+    assert calls == ["example"]
+    assert handler._executor_pending == 0
+
+
+@pytest.mark.asyncio
+async def test_directory_handler_io_threads_files(tmp_path):
+    """Files which aren't sent in one go are read in the thread pool."""
+    (tmp_path / "text.txt").write_text("line\n" * 1000)
+    (tmp_path / "binary").write_bytes(b"\xff" * 100)
+    handler = DirectoryHandler(str(tmp_path), io_threads=1, stream_text_size=1024)
+
+    response = await handler.handle(Request("localhost", 7000, "binary"))
+    assert response.executor is handler._executor
+
+    submitted = []
+    submit = handler._executor.submit
+    handler._executor.submit = lambda function, *args: submitted.append(function) or submit(
+        function, *args,
+    )
+    response = await handler.handle(Request("localhost", 7000, "text.txt"))
+    assert b"".join([chunk async for chunk in response]) == encode_text("line\n" * 1000)
+    # Once for the request itself, and then to open and read the file.
+    assert len(submitted) > 3 and open in submitted
+    handler._executor.shutdown()
+
+
 @pytest.fixture
 def pattern_handler() -> PatternHandler:
     handler = PatternHandler()
@@ -119,3 +310,76 @@ async def test_pattern_handler_not_found(pattern_handler: PatternHandler):
     """Unrecognised pattern raises NotFound."""
     with pytest.raises(NotFound):
         await pattern_handler.handle(Request("localhost", 7000, "qwertyuiop"))
+
+
+@pytest.mark.asyncio
+async def test_pattern_handler_registration_order():
+    """The first matching pattern wins, whether it's static or dynamic."""
+    handler = PatternHandler()
+
+    @handler.register("first/.*")
+    def first(request):
+        return "first"
+
+    @handler.register("first/static")
+    def first_static(request):
+        return "first static"
+
+    @handler.register("second/static")
+    def second_static(request):
+        return "second static"
+
+    @handler.register("second/.*")
+    def second(request):
+        return "second"
+
+    assert await handler.handle(Request("localhost", 7000, "first/static")) == "first"
+    assert await handler.handle(Request("localhost", 7000, "second/static")) == "second static"
+    assert await handler.handle(Request("localhost", 7000, "second/dynamic")) == "second"
+
+
+@pytest.mark.asyncio
+async def test_pattern_handler_process_executor():
+    """Views can be run in a process pool, and their dependencies are copied back."""
+    handler = PatternHandler(processes=1)
+    handler.register("hello/(?P<name>.+)", executor="process")(process_view)
+
+    request = Request("localhost", 7000, "hello/world")
+    try:
+        response = await handler.handle(request)
+    finally:
+        handler.close()
+    assert isinstance(response, EncodedResponse)
+    assert response.data.startswith(b"hello world from ")
+    assert response.data != ("hello world from %s\r\n.\r\n" % os.getpid()).encode()
+    assert request.dependencies == [("/world", 1)]
+
+
+@pytest.mark.asyncio
+async def test_pattern_handler_thread_executor_timeout():
+    """Views run in a thread pool are answered with an error if they time out."""
+    handler = PatternHandler(threads=1)
+
+    @handler.register("slow", executor="thread", timeout=0.05)
+    def slow(request):
+        time.sleep(0.2)
+        return "slow"
+
+    @handler.register("fast", executor="thread")
+    def fast(request):
+        return "fast"
+
+    with pytest.raises(asyncio.TimeoutError):
+        await handler.handle(Request("localhost", 7000, "slow"))
+    assert await handler.handle(Request("localhost", 7000, "fast")) == "fast"
+
+
+def test_pattern_handler_executor_invalid():
+    """Async views and unknown executors can't be registered with an executor."""
+    handler = PatternHandler()
+    with pytest.raises(ValueError):
+        handler.register("view", executor="fibre")
+    with pytest.raises(ValueError):
+        @handler.register("view", executor="thread")
+        async def view(request):
+            return "view"
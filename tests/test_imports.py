@@ -0,0 +1,18 @@
+import subprocess
+import sys
+
+
+def imported_modules(module: str) -> set:
+    """Imports a module in a fresh interpreter, and returns everything it imported."""
+    result = subprocess.run(
+        [sys.executable, "-c", "import sys, %s; print(' '.join(sys.modules))" % module],
+        check=True, capture_output=True, text=True,
+    )
+    return set(result.stdout.split())
+
+
+def test_optional_dependencies_not_imported():
+    """Optional dependencies are only imported when they're used."""
+    modules = imported_modules("gopher_server.listeners")
+    for name in ("filetype", "aioquic", "cryptography", "cProfile", "multiprocessing"):
+        assert name not in modules
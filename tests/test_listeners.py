@@ -0,0 +1,459 @@
+import asyncio
+import os.path
+import pytest
+import socket
+import ssl
+import struct
+import subprocess
+
+from gopher_server.application import Application
+from gopher_server.handlers import DirectoryHandler, PatternHandler
+from gopher_server.listeners import (
+    QUIC_ENABLED, ConnectionLimits, _ConnectionCounter, _QuicStreamWriter, quic_listener,
+    reload_tls_certificates, tcp_listener, tcp_protocol_listener, tcp_tls_listener,
+)
+
+
+BASE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples/data/")
+
+
+async def request(listener, application: Application, selector: bytes) -> bytes:
+    """Starts a TCP listener on a random port and makes one request to it."""
+    server = await listener(application, "localhost", "127.0.0.1", 0)
+    try:
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        writer.write(selector)
+        response = await reader.read()
+        writer.close()
+        return response
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.fixture
+def application() -> Application:
+    return Application(DirectoryHandler(BASE_PATH))
+
+
+@pytest.fixture(params=[tcp_listener, tcp_protocol_listener])
+def listener(request):
+    return request.param
+
+
+@pytest.mark.asyncio
+async def test_tcp_listener_text(listener, application: Application):
+    """Text files are sent with CRLF line endings and a terminator."""
+    response = await request(listener, application, b"test/lol\r\n")
+    assert response.endswith(b"\r\n.\r\n")
+
+
+@pytest.mark.asyncio
+async def test_tcp_listener_file(listener, application: Application):
+    """Binary files are streamed unchanged."""
+    response = await request(listener, application, b"image.png\r\n")
+    with open(os.path.join(BASE_PATH, "image.png"), "rb") as f:
+        assert response == f.read()
+
+
+@pytest.mark.asyncio
+async def test_tcp_listener_no_newline(listener, application: Application):
+    """A selector without a newline is dispatched when the client stops sending."""
+    server = await listener(application, "localhost", "127.0.0.1", 0)
+    try:
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        writer.write(b"test/lol")
+        writer.write_eof()
+        response = await reader.read()
+        writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+    assert response.endswith(b"\r\n.\r\n")
+
+
+@pytest.mark.asyncio
+async def test_tcp_listener_read_timeout(listener, application: Application):
+    """Clients which don't send a selector in time are disconnected."""
+    limits = ConnectionLimits(read_timeout=0.05)
+    server = await listener(application, "localhost", "127.0.0.1", 0, limits=limits)
+    try:
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        writer.write(b"test/")
+        response = await asyncio.wait_for(reader.read(), 1)
+        writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+    assert response == b""
+
+
+@pytest.mark.asyncio
+async def test_tcp_listener_selector_too_long(listener, application: Application):
+    """Selectors over the maximum size are rejected."""
+    limits = ConnectionLimits(max_selector_size=16)
+    server = await listener(application, "localhost", "127.0.0.1", 0, limits=limits)
+    try:
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        writer.write(b"x" * 100 + b"\r\n")
+        response = await asyncio.wait_for(reader.read(), 1)
+        writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+    assert response == b"3Selector too long.\t\terror.host\t0\r\n.\r\n"
+
+
+@pytest.mark.asyncio
+async def test_tcp_listener_selector_too_long_default(listener, application: Application):
+    """Without a maximum selector size, lines over the default 64 KiB are rejected."""
+    server = await listener(application, "localhost", "127.0.0.1", 0)
+    try:
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        writer.write(b"x" * (2 ** 16 + 1024))
+        response = await asyncio.wait_for(reader.read(), 1)
+        writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+    assert response == b"3Selector too long.\t\terror.host\t0\r\n.\r\n"
+
+
+@pytest.mark.asyncio
+async def test_tcp_listener_client_disconnect(listener, caplog):
+    """Clients disconnecting mid-response are handled quietly, and streams are closed."""
+    handler = PatternHandler()
+    closed = asyncio.Event()
+
+    @handler.register("stream")
+    async def stream(request):
+        try:
+            while True:
+                yield b"x" * 65536
+        finally:
+            closed.set()
+
+    server = await listener(Application(handler), "localhost", "127.0.0.1", 0)
+    try:
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        writer.write(b"stream\r\n")
+        await reader.readexactly(65536)
+        # Reset the connection rather than closing it cleanly.
+        writer.get_extra_info("socket").setsockopt(
+            socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0),
+        )
+        writer.transport.abort()
+        await asyncio.wait_for(closed.wait(), 5)
+        await asyncio.sleep(0.1)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    assert not [record for record in caplog.records if record.levelname == "ERROR"]
+
+
+@pytest.mark.asyncio
+async def test_tcp_listener_connections_per_ip(listener, application: Application):
+    """Connections over the per-IP limit get a busy error."""
+    limits = ConnectionLimits(max_connections_per_ip=1)
+    server = await listener(application, "localhost", "127.0.0.1", 0, limits=limits)
+    try:
+        address = server.sockets[0].getsockname()
+        first_reader, first_writer = await asyncio.open_connection(*address)
+        await asyncio.sleep(0.05)
+        second_reader, second_writer = await asyncio.open_connection(*address)
+        busy_response = await asyncio.wait_for(second_reader.read(), 1)
+        second_writer.close()
+
+        first_writer.write(b"test/lol\r\n")
+        response = await asyncio.wait_for(first_reader.read(), 1)
+        first_writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+    assert busy_response == b"3Server busy.\t\terror.host\t0\r\n.\r\n"
+    assert response.endswith(b"\r\n.\r\n")
+
+
+def create_certificate(path, name: str):
+    """Creates a self-signed certificate with openssl."""
+    certificate_path = str(path / "server.crt")
+    private_key_path = str(path / "key.pem")
+    try:
+        subprocess.run(
+            [
+                "openssl", "req", "-x509", "-newkey", "ec",
+                "-pkeyopt", "ec_paramgen_curve:prime256v1", "-nodes", "-days", "1",
+                "-subj", "/CN=" + name, "-keyout", private_key_path, "-out", certificate_path,
+            ],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        pytest.skip("openssl is needed to create a certificate")
+    return certificate_path, private_key_path
+
+
+def tls_client_context() -> ssl.SSLContext:
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+def tls_request(context: ssl.SSLContext, address, session=None):
+    """Makes a blocking TLS request, and returns the session and certificate."""
+    with socket.create_connection(address) as sock:
+        with context.wrap_socket(sock, server_hostname="localhost", session=session) as tls_sock:
+            tls_sock.sendall(b"test/lol\r\n")
+            while tls_sock.recv(4096):
+                pass
+            return tls_sock.session, tls_sock.session_reused, tls_sock.getpeercert(True)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("session_tickets", [True, False])
+async def test_tls_session_resumption(tmp_path, application: Application, session_tickets: bool):
+    """Returning clients can resume their session, with or without tickets."""
+    certificate = create_certificate(tmp_path, "localhost")
+    server = await tcp_tls_listener(
+        application, "localhost", "127.0.0.1", 0, *certificate, session_tickets=session_tickets,
+    )
+    loop = asyncio.get_running_loop()
+    context = tls_client_context()
+    try:
+        address = server.sockets[0].getsockname()
+        session, reused, _ = await loop.run_in_executor(None, tls_request, context, address)
+        assert not reused
+        _, reused, _ = await loop.run_in_executor(None, tls_request, context, address, session)
+        assert reused
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_tls_certificate_reload(tmp_path, application: Application):
+    """Reloading replaces the certificate for new connections."""
+    certificate = create_certificate(tmp_path, "old")
+    server = await tcp_tls_listener(application, "localhost", "127.0.0.1", 0, *certificate)
+    loop = asyncio.get_running_loop()
+    context = tls_client_context()
+    try:
+        address = server.sockets[0].getsockname()
+        _, _, old_certificate = await loop.run_in_executor(None, tls_request, context, address)
+        create_certificate(tmp_path, "new")
+        reload_tls_certificates()
+        _, _, new_certificate = await loop.run_in_executor(None, tls_request, context, address)
+    finally:
+        server.close()
+        await server.wait_closed()
+    assert old_certificate != new_certificate
+    with open(certificate[0]) as f:
+        assert new_certificate == ssl.PEM_cert_to_DER_cert(f.read())
+
+
+@pytest.mark.asyncio
+async def test_tcp_listener_rate_limit(listener, application: Application):
+    """Requests over an IP's rate limit get an error, weighted by route cost."""
+    limits = ConnectionLimits(
+        requests_per_second=0.001, request_burst=3, route_costs={"test/.*": 2},
+    )
+    server = await listener(application, "localhost", "127.0.0.1", 0, limits=limits)
+    try:
+        address = server.sockets[0].getsockname()
+        responses = []
+        for selector in (b"test/lol\r\n", b"test/lol\r\n", b"example\r\n", b"example\r\n"):
+            reader, writer = await asyncio.open_connection(*address)
+            writer.write(selector)
+            responses.append(await asyncio.wait_for(reader.read(), 1))
+            writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+    rate_limited = b"3Too many requests.\t\terror.host\t0\r\n.\r\n"
+    assert responses[0].endswith(b"\r\n.\r\n") and responses[0] != rate_limited
+    assert responses[1] == rate_limited
+    assert responses[2] != rate_limited
+    assert responses[3] == rate_limited
+
+
+@pytest.mark.asyncio
+async def test_tcp_listener_max_in_flight(listener):
+    """Requests over the in-flight limit are shed."""
+    handler = PatternHandler()
+    release = asyncio.Event()
+
+    @handler.register("slow")
+    async def slow(request):
+        await release.wait()
+        return "done"
+
+    limits = ConnectionLimits(max_in_flight=1)
+    server = await listener(Application(handler), "localhost", "127.0.0.1", 0, limits=limits)
+    try:
+        address = server.sockets[0].getsockname()
+        first_reader, first_writer = await asyncio.open_connection(*address)
+        first_writer.write(b"slow\r\n")
+        await asyncio.sleep(0.05)
+        second_reader, second_writer = await asyncio.open_connection(*address)
+        second_writer.write(b"slow\r\n")
+        shed_response = await asyncio.wait_for(second_reader.read(), 1)
+        second_writer.close()
+        release.set()
+        response = await asyncio.wait_for(first_reader.read(), 1)
+        first_writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+    assert shed_response == b"3Server busy.\t\terror.host\t0\r\n.\r\n"
+    assert response == b"done\r\n.\r\n"
+
+
+@pytest.mark.asyncio
+async def test_tcp_listener_shared_limits(application: Application):
+    """Listeners given the same limits share them."""
+    limits = ConnectionLimits(requests_per_second=0.001, request_burst=1)
+    servers = [
+        await listener(application, "localhost", "127.0.0.1", 0, limits=limits)
+        for listener in (tcp_listener, tcp_protocol_listener)
+    ]
+    try:
+        responses = []
+        for server in servers:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+            writer.write(b"test/lol\r\n")
+            responses.append(await asyncio.wait_for(reader.read(), 1))
+            writer.close()
+    finally:
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+    assert responses[0].endswith(b"\r\n.\r\n")
+    assert responses[1] == b"3Too many requests.\t\terror.host\t0\r\n.\r\n"
+
+
+def test_rate_limit_memory_bounded():
+    """Only the most recently seen IP addresses are tracked."""
+    counter = _ConnectionCounter(ConnectionLimits(requests_per_second=1, max_tracked_ips=100))
+    for i in range(1000):
+        assert counter.admit("10.0.%s.%s" % (i // 256, i % 256), b"") is None
+        counter.finish()
+    assert len(counter.buckets) == 100
+    assert counter.in_flight == 0
+
+
+def test_rate_limit_route_cost_over_burst():
+    """The default burst covers the largest route cost, and a lower burst is rejected."""
+    limits = ConnectionLimits(requests_per_second=2, route_costs={"search/.*": 5})
+    counter = _ConnectionCounter(limits)
+    assert counter.admit("10.0.0.1", b"search/gopher\r\n") is None
+    counter.finish()
+
+    limits = ConnectionLimits(
+        requests_per_second=2, request_burst=3, route_costs={"search/.*": 5},
+    )
+    with pytest.raises(ValueError):
+        _ConnectionCounter(limits)
+
+
+async def quic_request(address, selector: bytes, finish: bool=True) -> bytes:
+    """Makes one request on a new QUIC connection."""
+    from aioquic.asyncio import connect
+    from aioquic.quic.configuration import QuicConfiguration
+
+    configuration = QuicConfiguration(is_client=True, verify_mode=ssl.CERT_NONE)
+    async with connect(*address, configuration=configuration) as client:
+        reader, writer = await client.create_stream()
+        writer.write(selector)
+        if finish:
+            writer.write_eof()
+        return await asyncio.wait_for(reader.read(), 5)
+
+
+async def start_quic_listener(tmp_path, application: Application, **kwargs):
+    certificate = create_certificate(tmp_path, "localhost")
+    server = await quic_listener(application, "localhost", "127.0.0.1", 0, *certificate, **kwargs)
+    return server, server._transport.get_extra_info("sockname")
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not QUIC_ENABLED, reason="aioquic is not installed")
+async def test_quic_listener_large_file(tmp_path):
+    """Large files are sent in full over QUIC."""
+    data_path = tmp_path / "data"
+    data_path.mkdir()
+    data = os.urandom(2 * 1024 * 1024)
+    (data_path / "large").write_bytes(data)
+    server, address = await start_quic_listener(
+        tmp_path, Application(DirectoryHandler(str(data_path))),
+    )
+    try:
+        assert await quic_request(address, b"large\r\n") == data
+    finally:
+        server.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not QUIC_ENABLED, reason="aioquic is not installed")
+async def test_quic_listener_read_timeout(tmp_path, application: Application):
+    """Streams which don't send a selector are closed and free their slot."""
+    server, address = await start_quic_listener(
+        tmp_path, application, max_streams=1, read_timeout=0.1,
+    )
+    try:
+        assert await quic_request(address, b"test/", finish=False) == b""
+        assert (await quic_request(address, b"test/lol\r\n")).endswith(b"\r\n.\r\n")
+    finally:
+        server.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not QUIC_ENABLED, reason="aioquic is not installed")
+@pytest.mark.parametrize("max_selector_size, length", [(16, 100), (None, 2 ** 16 + 1024)])
+async def test_quic_listener_selector_too_long(tmp_path, application: Application,
+                                               max_selector_size, length):
+    """Selectors over the maximum size, or over 64 KiB, are rejected."""
+    server, address = await start_quic_listener(
+        tmp_path, application, max_selector_size=max_selector_size,
+    )
+    try:
+        response = await quic_request(address, b"x" * length + b"\r\n")
+    finally:
+        server.close()
+    assert response == b"3Selector too long.\t\terror.host\t0\r\n.\r\n"
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(not QUIC_ENABLED, reason="aioquic is not installed")
+async def test_quic_listener_rate_limit(tmp_path, application: Application):
+    """QUIC requests are rate limited by IP address."""
+    server, address = await start_quic_listener(
+        tmp_path, application,
+        limits=ConnectionLimits(requests_per_second=0.001, request_burst=1),
+    )
+    try:
+        first = await quic_request(address, b"test/lol\r\n")
+        second = await quic_request(address, b"test/lol\r\n")
+    finally:
+        server.close()
+    assert first.endswith(b"\r\n.\r\n")
+    assert second == b"3Too many requests.\t\terror.host\t0\r\n.\r\n"
+
+
+@pytest.mark.asyncio
+async def test_quic_stream_writer_fallback():
+    """Without the aioquic internals it uses, drain() falls back to the writer's own."""
+    class Transport:
+        protocol = object()
+        stream_id = 0
+
+    class Writer:
+        transport = Transport()
+        drained = False
+
+        async def drain(self):
+            self.drained = True
+
+    writer = Writer()
+    await _QuicStreamWriter(writer).drain()
+    assert writer.drained
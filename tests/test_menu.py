@@ -1,4 +1,6 @@
-from gopher_server.menu import InfoMenuItem, Menu, MenuItem
+import pytest
+
+from gopher_server.menu import InfoMenuItem, LazyMenu, Menu, MenuItem
 
 
 def test_menu_item():
@@ -18,3 +20,22 @@ def test_menu():
         MenuItem("0", "foo", "hello/foo", "localhost", 7000),
     ])
     assert menu.serialize() == "ihello world example menu\t\terror.host\t0\r\nthis is a string\r\n0foo\thello/foo\tlocalhost\t7000"
+
+
+@pytest.mark.asyncio
+async def test_lazy_menu():
+    def items():
+        yield InfoMenuItem("hello world example menu")
+        yield "this is a string"
+        yield MenuItem("0", "foo", "hello/foo", "localhost", 7000)
+    menu = LazyMenu(items())
+    assert "".join([chunk async for chunk in menu]) == "ihello world example menu\t\terror.host\t0\nthis is a string\n0foo\thello/foo\tlocalhost\t7000\n"
+
+
+def test_menu_serialize_bytes():
+    menu = Menu([
+        InfoMenuItem("hello world example menu"),
+        "this is a string",
+        MenuItem("0", "foo", "hello/foo", "localhost", 7000),
+    ])
+    assert menu.serialize_bytes() == b"ihello world example menu\t\terror.host\t0\r\nthis is a string\r\n0foo\thello/foo\tlocalhost\t7000\r\n.\r\n"
@@ -0,0 +1,48 @@
+import os
+import pytest
+
+from gopher_server import handlers
+from gopher_server.handlers import DirectoryHandler, Request
+from gopher_server.menu import Menu, MenuItem
+from gopher_server.menu_index import MenuIndex
+
+
+@pytest.fixture
+def data_path(tmp_path):
+    data_path = tmp_path / "data"
+    (data_path / "sub").mkdir(parents=True)
+    (data_path / "foo.txt").write_text("foo")
+    (data_path / "sub" / "bar.png").write_text("bar")
+    return data_path
+
+
+def test_menu_index_update(data_path, tmp_path):
+    """Only changed directories are listed again."""
+    index = MenuIndex(str(tmp_path / "index.sqlite"))
+    assert index.update(str(data_path)) == 2
+    assert index.update(str(data_path)) == 0
+
+    (data_path / "sub" / "baz.txt").write_text("baz")
+    assert index.update(str(data_path)) == 1
+
+    sub_mtime = os.stat(data_path / "sub").st_mtime_ns
+    assert index.get("sub", sub_mtime) == [("I", "bar.png"), ("0", "baz.txt")]
+    assert index.get("sub", sub_mtime - 1) is None
+
+
+@pytest.mark.asyncio
+async def test_directory_handler_menu_index(data_path, tmp_path, monkeypatch):
+    """Directory handler serves generated menus from the index."""
+    index = MenuIndex(str(tmp_path / "index.sqlite"))
+    index.update(str(data_path))
+
+    def _directory_entries(path):
+        raise AssertionError("directory listed")
+    monkeypatch.setattr(handlers, "_directory_entries", _directory_entries)
+
+    handler = DirectoryHandler(str(data_path), generate_menus=True, menu_index=index)
+    response = await handler.handle(Request("localhost", 7000, ""))
+    assert response == Menu([
+        MenuItem("0", "foo.txt", "foo.txt", "localhost", 7000),
+        MenuItem("1", "sub",     "sub",     "localhost", 7000),
+    ])
@@ -0,0 +1,65 @@
+import asyncio
+import os.path
+import pytest
+
+from gopher_server.application import Application
+from gopher_server.handlers import DirectoryHandler, PatternHandler
+from gopher_server.listeners import tcp_listener
+from gopher_server.metrics import Metrics
+
+
+BASE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples/data/")
+
+
+def test_render_histogram():
+    """Latencies are rendered as a cumulative histogram."""
+    metrics = Metrics()
+    metrics.observe_request("PatternHandler", "page/(.*)", "ok", 0.002)
+    metrics.observe_request("PatternHandler", "page/(.*)", "ok", 20)
+    rendered = metrics.render()
+    labels = 'handler="PatternHandler",pattern="page/(.*)",outcome="ok"'
+    assert 'gopher_request_duration_seconds_bucket{le="0.001",%s} 0' % labels in rendered
+    assert 'gopher_request_duration_seconds_bucket{le="0.0025",%s} 1' % labels in rendered
+    assert 'gopher_request_duration_seconds_bucket{le="+Inf",%s} 2' % labels in rendered
+    assert "gopher_request_duration_seconds_count{%s} 2" % labels in rendered
+
+
+@pytest.mark.asyncio
+async def test_application_outcomes():
+    """The application records the pattern and outcome of each request."""
+    handler = PatternHandler()
+
+    @handler.register("hello/(?P<name>.*)")
+    def hello(request, name):
+        return "Hello, %s" % name
+
+    metrics = Metrics()
+    application = Application(handler, metrics=metrics)
+    await application.dispatch("localhost", 7000, b"hello/world\r\n")
+    await application.dispatch("localhost", 7000, b"missing\r\n")
+    await application.dispatch("localhost", 7000, b"\xff\r\n")
+
+    assert {key[1:] for key in metrics._latencies} == {
+        ("hello/(?P<name>.*)", "ok"), (None, "not_found"), (None, "bad_selector"),
+    }
+    assert metrics.requests_in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_listener_metrics():
+    """Listeners record connections and bytes sent."""
+    metrics = Metrics()
+    application = Application(DirectoryHandler(BASE_PATH), metrics=metrics)
+    server = await tcp_listener(application, "localhost", "127.0.0.1", 0)
+    try:
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+        writer.write(b"example\r\n")
+        response = await reader.read()
+        writer.close()
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    assert metrics.connections["tcp"] == 1
+    assert metrics.open_connections["tcp"] == 0
+    assert metrics.bytes_sent["tcp"] == len(response)
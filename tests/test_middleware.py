@@ -0,0 +1,161 @@
+import asyncio
+import os.path
+import pytest
+
+from gopher_server.application import Application
+from gopher_server.cache import ResponseCache
+from gopher_server.handlers import DirectoryHandler, PatternHandler, Request
+from gopher_server.middleware import (
+    CacheMiddleware, CoalescingMiddleware, TimingMiddleware,
+)
+
+
+BASE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples/data/")
+
+
+class Recorder:
+    def __init__(self, name: str, calls: list, answer: str=None):
+        self.name = name
+        self.calls = calls
+        self.answer = answer
+
+    async def handle(self, request, handler):
+        self.calls.append(self.name)
+        if self.answer is not None:
+            return self.answer
+        return await handler.handle(request)
+
+
+@pytest.mark.asyncio
+async def test_middleware_order():
+    """Middlewares run in order, and can answer without calling the handler."""
+    handler = PatternHandler()
+
+    @handler.register("")
+    def home(request):
+        calls.append("handler")
+        return "home"
+
+    calls = []
+    application = Application(handler, middleware=[
+        Recorder("first", calls), Recorder("second", calls),
+    ])
+    assert await application.dispatch("localhost", 7000, b"\r\n") == b"home\r\n.\r\n"
+    assert calls == ["first", "second", "handler"]
+
+    calls = []
+    application = Application(handler, middleware=[
+        Recorder("first", calls, answer="short"), Recorder("second", calls),
+    ])
+    assert await application.dispatch("localhost", 7000, b"\r\n") == b"short\r\n.\r\n"
+    assert calls == ["first"]
+
+
+@pytest.mark.asyncio
+async def test_cache_middleware():
+    """Responses with dependencies are served from the cache."""
+    cache = ResponseCache(max_bytes=1024 * 1024)
+    application = Application(DirectoryHandler(BASE_PATH), middleware=[CacheMiddleware(cache)])
+
+    first = await application.dispatch("localhost", 7000, b"test/lol\r\n")
+    second = await application.dispatch("localhost", 7000, b"test/lol\r\n")
+    assert first == second
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_timing_middleware():
+    """Handler times are recorded by pattern."""
+    handler = PatternHandler()
+
+    @handler.register("page/(?P<name>.+)")
+    def page(request, name):
+        return name
+
+    timing = TimingMiddleware()
+    application = Application(handler, middleware=[timing])
+    await application.dispatch("localhost", 7000, b"page/a\r\n")
+    await application.dispatch("localhost", 7000, b"page/b\r\n")
+    await application.dispatch("localhost", 7000, b"missing\r\n")
+    assert timing.timings["page/(?P<name>.+)"][0] == 2
+    assert timing.timings[None][0] == 1
+
+
+@pytest.mark.asyncio
+async def test_coalescing_middleware():
+    """Concurrent requests for the same selector share one handler call."""
+    handler = PatternHandler()
+    calls = []
+    release = asyncio.Event()
+
+    @handler.register("slow/(?P<name>.+)")
+    async def slow(request, name):
+        calls.append(name)
+        await release.wait()
+        return name
+
+    coalescing = CoalescingMiddleware(patterns=["slow/a"])
+    application = Application(handler, middleware=[coalescing])
+    tasks = [
+        asyncio.ensure_future(application.dispatch("localhost", 7000, selector))
+        for selector in [b"slow/a\r\n", b"slow/a\r\n", b"slow/b\r\n", b"slow/b\r\n"]
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    responses = await asyncio.gather(*tasks)
+
+    assert responses == [b"a\r\n.\r\n"] * 2 + [b"b\r\n.\r\n"] * 2
+    assert sorted(calls) == ["a", "b", "b"]
+    assert coalescing.coalesced == 1
+
+
+@pytest.mark.asyncio
+async def test_coalescing_middleware_cancelled():
+    """Cancelling the first request doesn't cancel the shared handler call."""
+    handler = PatternHandler()
+    release = asyncio.Event()
+
+    @handler.register("")
+    async def home(request):
+        await release.wait()
+        return "home"
+
+    application = Application(handler, middleware=[CoalescingMiddleware()])
+    first = asyncio.ensure_future(application.dispatch("localhost", 7000, b"\r\n"))
+    second = asyncio.ensure_future(application.dispatch("localhost", 7000, b"\r\n"))
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+    assert await second == b"home\r\n.\r\n"
+
+
+@pytest.mark.asyncio
+async def test_coalescing_middleware_cancelled_stream():
+    """A streamed response is closed if the request which started it is cancelled."""
+    release = asyncio.Event()
+    closed = []
+
+    class Stream:
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            raise StopAsyncIteration
+
+        async def aclose(self):
+            closed.append(self)
+
+    class StreamHandler:
+        async def handle(self, request):
+            await release.wait()
+            return Stream()
+
+    coalescing = CoalescingMiddleware()
+    first = asyncio.ensure_future(
+        coalescing.handle(Request("localhost", 7000, ""), StreamHandler()),
+    )
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+    await asyncio.sleep(0.01)
+    assert len(closed) == 1
@@ -0,0 +1,79 @@
+import os.path
+import pytest
+
+from gopher_server.application import Application
+from gopher_server.handlers import DirectoryHandler, Request
+from gopher_server.pack import PackHandler, build_pack
+
+
+BASE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples/data/")
+
+
+@pytest.fixture
+def pack_path(tmp_path) -> str:
+    pack_path = str(tmp_path / "data.pack")
+    build_pack(BASE_PATH, pack_path, "localhost", 7000)
+    return pack_path
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("selector", [b"\r\n", b"example\r\n", b"/test/lol\r\n", b"image.png\r\n"])
+async def test_pack_matches_directory_handler(pack_path: str, selector: bytes):
+    """Packed responses are the same as DirectoryHandler's."""
+    pack_application = Application(PackHandler(pack_path))
+    directory_application = Application(DirectoryHandler(BASE_PATH))
+
+    pack_response = await pack_application.dispatch("localhost", 7000, selector)
+    directory_response = await directory_application.dispatch("localhost", 7000, selector)
+    if not isinstance(directory_response, bytes):
+        with open(directory_response.path, "rb") as f:
+            directory_response = f.read()
+    assert bytes(pack_response) == directory_response
+
+
+@pytest.mark.asyncio
+async def test_pack_generated_menu(pack_path: str):
+    """Directories without an index file get a generated menu."""
+    handler = PackHandler(pack_path)
+    response = await handler.handle(Request("localhost", 7000, "test"))
+    assert bytes(response.data) == b"0lol\ttest/lol\tlocalhost\t7000\r\n.\r\n"
+
+
+@pytest.mark.asyncio
+async def test_pack_not_found(pack_path: str):
+    """Unknown selectors and paths outside the base path aren't found."""
+    application = Application(PackHandler(pack_path))
+    for selector in (b"missing\r\n", b"../examples/data/example\r\n"):
+        response = await application.dispatch("localhost", 7000, selector)
+        assert response == b"3Not found.\t\terror.host\t0\r\n.\r\n"
+
+
+def test_pack_bad_file(tmp_path):
+    """Files which aren't packs are rejected."""
+    path = tmp_path / "bad.pack"
+    path.write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        PackHandler(str(path))
+
+
+@pytest.mark.asyncio
+async def test_pack_reload(tmp_path, pack_path: str):
+    """Reloading maps a rebuilt pack, and keeps the old one if the new one is invalid."""
+    handler = PackHandler(pack_path)
+    old_response = await handler.handle(Request("localhost", 7000, "example"))
+
+    data_path = tmp_path / "data"
+    data_path.mkdir()
+    (data_path / "example").write_text("new")
+    build_pack(str(data_path), pack_path)
+    handler.reload()
+    response = await handler.handle(Request("localhost", 7000, "example"))
+    assert bytes(response.data) == b"new\r\n.\r\n"
+    assert bytes(old_response.data) != bytes(response.data)
+
+    (tmp_path / "invalid.pack").write_bytes(b"\0" * 64)
+    os.replace(str(tmp_path / "invalid.pack"), pack_path)
+    with pytest.raises(ValueError):
+        handler.reload()
+    response = await handler.handle(Request("localhost", 7000, "example"))
+    assert bytes(response.data) == b"new\r\n.\r\n"
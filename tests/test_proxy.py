@@ -0,0 +1,119 @@
+import asyncio
+import pytest
+
+from gopher_server.application import Application
+from gopher_server.handlers import PatternHandler, Request
+from gopher_server.listeners import tcp_listener
+from gopher_server.menu import Menu, MenuItem
+from gopher_server.proxy import ProxyHandler, Upstream
+
+
+async def start_upstream():
+    """Starts an upstream server, and returns it with its port."""
+    handler = PatternHandler()
+    address = {}
+
+    @handler.register("gopher/")
+    def home(request):
+        return Menu([
+            MenuItem("0", "Local", "gopher/page", "127.0.0.1", address["port"]),
+            MenuItem("0", "Other", "gopher/page", "example.com", 70),
+        ])
+
+    @handler.register("gopher/page")
+    def page(request):
+        return "A\tpage\twith\t70 tabs\n"
+
+    @handler.register("gopher/slow")
+    async def slow(request):
+        await asyncio.sleep(0.1)
+        return "slow"
+
+    server = await tcp_listener(Application(handler), "127.0.0.1", "127.0.0.1", 0)
+    address["port"] = server.sockets[0].getsockname()[1]
+    return server, address["port"]
+
+
+async def read_response(response) -> bytes:
+    if isinstance(response, bytes):
+        return response
+    return b"".join([chunk async for chunk in response])
+
+
+@pytest.mark.asyncio
+async def test_proxy_rewrites_menus():
+    """Links to the upstream server in menus point back through the proxy."""
+    server, port = await start_upstream()
+    try:
+        application = Application(ProxyHandler({
+            "up/": Upstream("127.0.0.1", port, selector_prefix="gopher/"),
+        }))
+        menu = await read_response(await application.dispatch("proxy.host", 7000, b"up/\r\n"))
+        text = await read_response(await application.dispatch("proxy.host", 7000, b"up/page\r\n"))
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    assert menu == (
+        b"0Local\tup/page\tproxy.host\t7000\r\n"
+        b"0Other\tgopher/page\texample.com\t70\r\n"
+        b".\r\n"
+    )
+    # Text which doesn't start with a menu line is passed through unchanged.
+    assert text == b"A\tpage\twith\t70 tabs\r\n.\r\n"
+
+
+@pytest.mark.asyncio
+async def test_proxy_unavailable():
+    """Unreachable upstreams get an error, and unrouted selectors aren't found."""
+    server, port = await start_upstream()
+    server.close()
+    await server.wait_closed()
+
+    application = Application(ProxyHandler({"gopher/": Upstream("127.0.0.1", port)}))
+    response = await application.dispatch("localhost", 7000, b"gopher/\r\n")
+    assert response == b"3Upstream server unavailable.\t\terror.host\t0\r\n.\r\n"
+
+    response = await application.dispatch("localhost", 7000, b"missing\r\n")
+    assert response == b"3Not found.\t\terror.host\t0\r\n.\r\n"
+
+
+@pytest.mark.asyncio
+async def test_proxy_max_connections():
+    """Requests over an upstream's connection limit wait for a slot."""
+    server, port = await start_upstream()
+    try:
+        application = Application(ProxyHandler({
+            "": Upstream("127.0.0.1", port, max_connections=1, connect_timeout=0.05),
+        }))
+        first = await application.dispatch("localhost", 7000, b"gopher/slow\r\n")
+        second = await application.dispatch("localhost", 7000, b"gopher/slow\r\n")
+        assert second == b"3Upstream server unavailable.\t\terror.host\t0\r\n.\r\n"
+        assert await read_response(first) == b"slow\r\n.\r\n"
+        third = await application.dispatch("localhost", 7000, b"gopher/slow\r\n")
+        assert await read_response(third) == b"slow\r\n.\r\n"
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_proxy_aclose():
+    """Closing a response frees its connection slot, even if it wasn't started."""
+    server, port = await start_upstream()
+    try:
+        handler = ProxyHandler({
+            "": Upstream("127.0.0.1", port, max_connections=1, connect_timeout=0.05),
+        })
+        response = await handler.handle(Request("localhost", 7000, "gopher/slow"))
+        await response.aclose()
+
+        application = Application(handler)
+        response = await application.dispatch("localhost", 7000, b"gopher/\r\n")
+        await response.aclose()
+
+        response = await application.dispatch("localhost", 7000, b"gopher/slow\r\n")
+        assert await read_response(response) == b"slow\r\n.\r\n"
+    finally:
+        server.close()
+        await server.wait_closed()
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import os.path
+import pytest
+
+from gopher_server.application import Application
+from gopher_server.handlers import DirectoryHandler
+from gopher_server.listeners import tcp_listener
+from gopher_server.tracing import Tracer, current_trace, span
+
+
+BASE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples/data/")
+
+
+def test_span_without_trace():
+    """Spans do nothing outside a traced request."""
+    assert current_trace() is None
+    with span("nothing"):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_slow_request_logged(caplog):
+    """Requests over the threshold are logged with their spans."""
+    application = Application(
+        DirectoryHandler(BASE_PATH, generate_menus=True, io_threads=1), tracer=Tracer(0),
+    )
+    server = await tcp_listener(application, "localhost", "127.0.0.1", 0)
+    try:
+        with caplog.at_level(logging.WARNING, logger="gopher_server.tracing"):
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname())
+            writer.write(b"\r\n")
+            await reader.read()
+            writer.close()
+            # Give the connection handler a moment to finish.
+            await asyncio.sleep(0.01)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+    message = caplog.records[-1].getMessage()
+    assert message.startswith("Slow request ''")
+    for name in ("read", "stat", "list_directory", "handler", "serialize", "write"):
+        assert name + " " in message
+
+
+@pytest.mark.asyncio
+async def test_profiling(tmp_path):
+    """Sampled requests are profiled to pstats files."""
+    tracer = Tracer(profile_rate=1, profile_dir=str(tmp_path))
+    application = Application(DirectoryHandler(BASE_PATH), tracer=tracer)
+
+    await application.dispatch("localhost", 7000, b"example\r\n")
+    assert list(tmp_path.iterdir()) == []
+
+    tracer.toggle_profiling()
+    await application.dispatch("localhost", 7000, b"example\r\n")
+    assert len(list(tmp_path.iterdir())) == 1
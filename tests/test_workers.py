@@ -0,0 +1,106 @@
+import os.path
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+
+BASE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples/data/")
+
+SERVER = """
+import logging, sys
+from functools import partial
+from gopher_server.application import Application
+from gopher_server.handlers import DirectoryHandler, PatternHandler
+from gopher_server.listeners import tcp_listener
+from gopher_server.workers import run_workers
+
+logging.basicConfig(level=logging.INFO)
+if sys.argv[1] == "process":
+    handler = PatternHandler(processes=1)
+    # A builtin, so the pool processes can unpickle it.
+    handler.register("test/lol", executor="process")(repr)
+else:
+    handler = DirectoryHandler(sys.argv[1])
+run_workers(Application(handler), [
+    partial(tcp_listener, hostname="localhost", host="127.0.0.1", port=int(sys.argv[2]),
+            reuse_port=True),
+], workers=2, drain_timeout=5)
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def gopher_request(port: int, selector: bytes) -> bytes:
+    """Makes a blocking request, retrying until the workers are listening."""
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+                sock.sendall(selector)
+                chunks = []
+                for chunk in iter(lambda: sock.recv(4096), b""):
+                    chunks.append(chunk)
+                return b"".join(chunks)
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def test_run_workers():
+    """Workers share the port, and SIGTERM stops them cleanly."""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-c", SERVER, BASE_PATH, str(port)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stderr=subprocess.PIPE, text=True,
+    )
+    try:
+        for _ in range(4):
+            assert gopher_request(port, b"test/lol\r\n").endswith(b"\r\n.\r\n")
+        process.send_signal(signal.SIGTERM)
+        _, stderr = process.communicate(timeout=10)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    assert process.returncode == 0
+    assert "crashed" not in stderr
+    assert "Served 4 requests" in stderr
+
+
+def test_run_workers_process_pool():
+    """Process pools are shut down with their worker, and don't keep the port open."""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-c", SERVER, "process", str(port)],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stderr=subprocess.PIPE, text=True,
+    )
+    try:
+        for _ in range(4):
+            assert gopher_request(port, b"test/lol\r\n").startswith(b"Request(")
+        process.send_signal(signal.SIGHUP)
+        time.sleep(0.5)
+        for _ in range(4):
+            assert gopher_request(port, b"test/lol\r\n").startswith(b"Request(")
+        process.send_signal(signal.SIGTERM)
+        process.communicate(timeout=10)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    assert process.returncode == 0
+
+    # Nothing is left listening on the port. SO_REUSEADDR allows binding over
+    # connections in TIME_WAIT, but not over a listening socket.
+    time.sleep(0.5)
+    with socket.socket() as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(("127.0.0.1", port))